@@ -0,0 +1,374 @@
+# In-process stand-ins for the IPFS HTTP API and a NEM NIS node, for reproducible measurements.
+# Both keep everything in memory and serve HTTP from a background thread:
+#   with FakeIPFS() as ipfs, FakeNIS() as nis:
+#       ipfsapi.connect(*ipfs.address)
+#       os.environ['COZ_NIS_ENDPOINT'] = nis.url   # before the node sidecar is spawned
+# An optional per-request latency emulates a remote daemon or node.
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+import hashlib
+import io
+import json
+import tarfile
+import threading
+import time
+
+class FakeServer():
+	def __init__(self, host='127.0.0.1', port=0, latency=0):
+		self.latency = latency
+		self.lock = threading.Lock()
+		# Requests served, by path
+		self.calls = Counter()
+		self.server = ThreadingHTTPServer((host, port), self.Handler)
+		self.server.daemon_threads = True
+		self.server.fake = self
+		self.thread = None
+
+	@property
+	def address(self):
+		return self.server.server_address[:2]
+
+	@property
+	def url(self):
+		return 'http://{}:{}'.format(*self.address)
+
+	def start(self):
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		return self
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def __enter__(self):
+		return self.start()
+
+	def __exit__(self, *exc):
+		self.stop()
+
+	class Handler(BaseHTTPRequestHandler):
+		protocol_version = 'HTTP/1.1'
+
+		def log_message(self, format, *args):
+			pass
+
+		@property
+		def fake(self):
+			return self.server.fake
+
+		def read_body(self):
+			if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+				body = io.BytesIO()
+				while True:
+					size = int(self.rfile.readline().split(b';')[0], 16)
+					if size == 0:
+						# Trailer, up to an empty line
+						while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+							pass
+						return body.getvalue()
+					body.write(self.rfile.read(size))
+					self.rfile.readline()
+			return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+		def send(self, body, status=200, content_type='application/json'):
+			if not isinstance(body, bytes):
+				body = (json.dumps(body) + '\n').encode()
+			self.send_response(status)
+			self.send_header('Content-Type', content_type)
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		# Size of the chunks streamed responses are split into
+		chunk_size = 1 << 15
+
+		# Streamed output, sent with chunked transfer encoding like go-ipfs does for cat and get
+		def send_stream(self, body, content_type='text/plain'):
+			self.send_response(200)
+			self.send_header('Content-Type', content_type)
+			self.send_header('Transfer-Encoding', 'chunked')
+			self.send_header('X-Stream-Output', '1')
+			self.end_headers()
+			for i in range(0, len(body), self.chunk_size):
+				chunk = body[i:i + self.chunk_size]
+				self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+			self.wfile.write(b'0\r\n\r\n')
+
+		def dispatch(self):
+			url = urlsplit(self.path)
+			query = parse_qs(url.query)
+			body = self.read_body() if self.command == 'POST' else b''
+			with self.fake.lock:
+				self.fake.calls[url.path] += 1
+			if self.fake.latency:
+				time.sleep(self.fake.latency)
+			try:
+				self.fake.handle(self, url.path, query, body)
+			except KeyError as e:
+				self.send({'Message': 'not found: {}'.format(e), 'Code': 0, 'Type': 'error'}, 500)
+
+		do_GET = dispatch
+		do_POST = dispatch
+
+def parse_multipart(content_type, body):
+	# Top-level parts of a multipart body as (headers, content)
+	boundary = content_type.split('boundary=', 1)[1].split(';')[0].strip('"').encode()
+	parts = []
+	for part in body.split(b'--' + boundary)[1:]:
+		if part.startswith(b'--'):
+			break
+		head, _, content = part.partition(b'\r\n\r\n')
+		headers = {}
+		for line in head.decode().strip().split('\r\n'):
+			name, _, value = line.partition(':')
+			headers[name.strip().lower()] = value.strip()
+		parts.append((headers, content[:-2] if content.endswith(b'\r\n') else content))
+	return parts
+
+def part_filename(headers):
+	disposition = headers.get('content-disposition', '')
+	for item in disposition.split(';'):
+		key, _, value = item.strip().partition('=')
+		if key == 'filename':
+			return unquote(value.strip('"'))
+	return ''
+
+class FakeIPFS(FakeServer):
+	# Covers the calls made through ipfsapi: add, cat (with offset and length), ls, get,
+	# object put/get/stat, pin add/ls/rm and version. Hashes are content-derived but not real multihashes.
+	version = '0.4.13'
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		# hash -> file content
+		self.files = {}
+		# hash -> list of (name, hash, size)
+		self.dirs = {}
+		self.pins = set()
+
+	def make_hash(self, data):
+		return 'Qm' + hashlib.sha256(data).hexdigest()[:44]
+
+	def add_file(self, data):
+		_hash = self.make_hash(b'file' + data)
+		with self.lock:
+			self.files[_hash] = data
+		return _hash
+
+	def add_dir(self, links):
+		links = sorted((name, _hash, int(size)) for name, _hash, size in links)
+		_hash = self.make_hash(b'dir' + json.dumps(links).encode())
+		with self.lock:
+			self.dirs[_hash] = links
+		return _hash
+
+	def resolve(self, path):
+		path = path.strip('/')
+		if path.startswith('ipfs/'):
+			path = path[5:]
+		_hash, *names = path.split('/')
+		for name in names:
+			links = {link[0]: link[1] for link in self.dirs[_hash]}
+			_hash = links[name]
+		if _hash not in self.files and _hash not in self.dirs:
+			raise KeyError(path)
+		return _hash
+
+	def size(self, _hash):
+		if _hash in self.files:
+			return len(self.files[_hash])
+		return sum(size for name, h, size in self.dirs[_hash])
+
+	def reachable(self, root, _hash):
+		return root == _hash or any(self.reachable(h, _hash) for name, h, size in self.dirs.get(root, ()))
+
+	def links_json(self, _hash):
+		return [{'Name': name, 'Hash': h, 'Size': size, 'Type': 1 if h in self.dirs else 2} for name, h, size in self.dirs[_hash]]
+
+	def tar(self, _hash, name, compress):
+		out = io.BytesIO()
+		with tarfile.open(fileobj=out, mode='w:gz' if compress else 'w') as tf:
+			def add(_hash, name):
+				info = tarfile.TarInfo(name)
+				if _hash in self.dirs:
+					info.type = tarfile.DIRTYPE
+					info.mode = 0o755
+					tf.addfile(info)
+					for child, h, size in self.dirs[_hash]:
+						add(h, name + '/' + child)
+				else:
+					data = self.files[_hash]
+					info.size = len(data)
+					info.mode = 0o644
+					tf.addfile(info, io.BytesIO(data))
+			add(_hash, name)
+		return out.getvalue()
+
+	def handle(self, req, path, query, body):
+		arg = query.get('arg', [None])[0]
+		if path == '/api/v0/version':
+			req.send({'Version': self.version, 'Commit': '', 'Repo': '6', 'System': 'fake', 'Golang': ''})
+		elif path == '/api/v0/add':
+			out = b''
+			for headers, content in parse_multipart(req.headers['Content-Type'], body):
+				_hash = self.add_file(content)
+				if query.get('pin', ['true'])[0].lower() == 'true':
+					self.pins.add(_hash)
+				out += (json.dumps({'Name': part_filename(headers), 'Hash': _hash, 'Size': str(len(content))}) + '\n').encode()
+			req.send(out)
+		elif path == '/api/v0/cat':
+			data = self.files[self.resolve(arg)]
+			offset = int(query.get('offset', [0])[0])
+			length = query.get('length')
+			end = offset + int(length[0]) if length else len(data)
+			req.send_stream(data[offset:end])
+		elif path == '/api/v0/ls':
+			_hash = self.resolve(arg)
+			links = self.links_json(_hash) if _hash in self.dirs else []
+			req.send({'Objects': [{'Hash': _hash, 'Links': links}]})
+		elif path == '/api/v0/get':
+			_hash = self.resolve(arg)
+			compress = query.get('compress', ['false'])[0].lower() == 'true'
+			req.send_stream(self.tar(_hash, arg.strip('/').split('/')[-1], compress), content_type='application/x-tar')
+		elif path == '/api/v0/object/put':
+			headers, content = parse_multipart(req.headers['Content-Type'], body)[0]
+			node = json.loads(content.decode())
+			_hash = self.add_dir((link['Name'], link['Hash'], link['Size']) for link in node['Links'])
+			req.send({'Hash': _hash, 'Links': self.links_json(_hash)})
+		elif path == '/api/v0/object/get':
+			_hash = self.resolve(arg)
+			if _hash in self.dirs:
+				req.send({'Links': self.links_json(_hash), 'Data': '\x08\x01'})
+			else:
+				req.send({'Links': [], 'Data': self.files[_hash].decode('latin-1')})
+		elif path == '/api/v0/object/stat':
+			_hash = self.resolve(arg)
+			links = self.dirs.get(_hash, [])
+			size = self.size(_hash)
+			req.send({'Hash': _hash, 'NumLinks': len(links), 'BlockSize': size, 'LinksSize': 0, 'DataSize': size, 'CumulativeSize': size})
+		elif path == '/api/v0/pin/add':
+			_hash = self.resolve(arg)
+			self.pins.add(_hash)
+			req.send({'Pins': [_hash]})
+		elif path == '/api/v0/pin/rm':
+			_hash = self.resolve(arg)
+			self.pins.discard(_hash)
+			req.send({'Pins': [_hash]})
+		elif path == '/api/v0/pin/ls':
+			if arg is None:
+				req.send({'Keys': {h: {'Type': 'recursive'} for h in self.pins}})
+			elif self.resolve(arg) in self.pins:
+				req.send({'Keys': {self.resolve(arg): {'Type': 'recursive'}}})
+			else:
+				# Pinned indirectly if reachable from a recursive pin
+				_hash = self.resolve(arg)
+				for pin in list(self.pins):
+					if self.reachable(pin, _hash):
+						req.send({'Keys': {_hash: {'Type': 'indirect through {}'.format(pin)}}})
+						return
+				raise KeyError('{} is not pinned'.format(arg))
+		else:
+			req.send({'Message': 'unknown command', 'Code': 0, 'Type': 'error'}, 404)
+
+class FakeNIS(FakeServer):
+	# Serves the NIS requests made by the node sidecar: incoming and outgoing transfer pages
+	# and transaction announcements. Announced transfer transactions are decoded and stored,
+	# so a sent batch shows up on the recipient's next refresh.
+	page_size = 25
+	nemesis_block = 1427587585
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.transactions = []
+		# Public key -> address, outgoing pages are looked up by the signer's address
+		self.addresses = {}
+
+	def register(self, pubkey, address):
+		self.addresses[pubkey] = address
+
+	def add_transfer(self, signer, recipient, payload='', message_type=1, timestamp=None):
+		with self.lock:
+			_id = len(self.transactions) + 1
+			tx = {
+				'meta': {
+					'innerHash': {},
+					'id': _id,
+					'hash': {'data': hashlib.sha3_256('{}:{}:{}:{}'.format(_id, signer, recipient, payload).encode()).hexdigest()},
+					'height': _id,
+				},
+				'transaction': {
+					'timeStamp': int(time.time()) - self.nemesis_block if timestamp is None else timestamp,
+					'amount': 0,
+					'fee': 0,
+					'recipient': recipient,
+					'type': 257,
+					'deadline': 0,
+					'version': -1744830463,
+					'signer': signer,
+					'signature': '',
+				},
+			}
+			if payload:
+				tx['transaction']['message'] = {'payload': payload, 'type': message_type}
+			self.transactions.append(tx)
+		return tx
+
+	def clear(self):
+		with self.lock:
+			self.transactions = []
+
+	# Serialized transfer transaction, as signed and announced by nem-sdk
+	def decode_transfer(self, data):
+		def read(fmt_size):
+			nonlocal pos
+			value = int.from_bytes(data[pos:pos+fmt_size], 'little', signed=True)
+			pos += fmt_size
+			return value
+		def read_bytes():
+			nonlocal pos
+			size = read(4)
+			value = data[pos:pos+size]
+			pos += size
+			return value
+		pos = 0
+		tx_type, version, timestamp = read(4), read(4), read(4)
+		signer = read_bytes().hex()
+		fee, deadline = read(8), read(4)
+		recipient = read_bytes().decode()
+		amount = read(8)
+		message_type, payload = None, b''
+		if read(4):
+			message_type = read(4)
+			payload = read_bytes()
+		return signer, recipient, timestamp, message_type, payload.hex()
+
+	def page(self, txs, query):
+		txs = sorted(txs, key=lambda tx: tx['meta']['id'], reverse=True)
+		if 'id' in query:
+			txs = [tx for tx in txs if tx['meta']['id'] < int(query['id'][0])]
+		return {'data': txs[:self.page_size]}
+
+	def handle(self, req, path, query, body):
+		if path == '/account/transfers/incoming':
+			address = query['address'][0]
+			req.send(self.page([tx for tx in self.transactions if tx['transaction']['recipient'] == address], query))
+		elif path == '/account/transfers/outgoing':
+			address = query['address'][0]
+			req.send(self.page([tx for tx in self.transactions if self.addresses.get(tx['transaction']['signer']) == address], query))
+		elif path == '/transaction/announce':
+			request = json.loads(body.decode())
+			signer, recipient, timestamp, message_type, payload = self.decode_transfer(bytes.fromhex(request['data']))
+			tx = self.add_transfer(signer, recipient, payload, message_type, timestamp)
+			req.send({
+				'innerTransactionHash': {},
+				'code': 1,
+				'type': 1,
+				'message': 'SUCCESS',
+				'transactionHash': {'data': tx['meta']['hash']['data']},
+			})
+		elif path == '/heartbeat':
+			req.send({'code': 1, 'type': 2, 'message': 'ok'})
+		else:
+			req.send({'error': 'Not Found', 'status': 404}, 404)
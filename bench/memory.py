@@ -0,0 +1,72 @@
+# Resident memory per DocumentBatch, before and after the compact record layout
+# Usage: python -m bench.memory [batches]
+import sys
+import tracemalloc
+from pathlib import Path
+from mvc.core.DocumentBatch import DocumentBatch
+
+# Layout used before slots: per-instance __dict__, a Path per document and an eager list
+class LegacyDocument():
+	def __init__(self, path, name):
+		self.path = Path(path)
+		self.name = name
+		self.hash = ''
+
+class LegacyDocumentBatch():
+	def __init__(self, title, sender, receiver):
+		self.title = title
+		self.timestamp = 0
+		self.documents = []
+		self.tx_hash = None
+		self.ipfs_hash = None
+		self.sender = sender
+		self.receiver = receiver
+
+def records(n, docs=3):
+	for i in range(n):
+		# Addresses arrive as fresh strings, as they do when read from storage or RPC
+		batch = {
+			'tx_hash': '{:064x}'.format(i),
+			'ipfs_hash': 'Qm{:044d}'.format(i),
+			'title': 'Invoice {}'.format(i),
+			'sender': ''.join(['TBOHNY6V7FXUEC5PCWZMDXE4RMJEPRJQP7F4PIY', 'C']),
+			'receiver': ''.join(['TCZ2SWDZ7OZF2IUBSNQHLHBXBZDAAWUVW6OSF4N', 'A']),
+			'timestamp': 1500000000 + i,
+		}
+		documents = [{'name': 'doc{}.pdf'.format(j), 'hash': 'Qm{:044d}'.format(i * docs + j), 'path': '.'} for j in range(docs)]
+		yield batch, documents
+
+def legacy(record):
+	batch, documents = record
+	db = LegacyDocumentBatch(batch['title'], batch['sender'], batch['receiver'])
+	db.timestamp, db.tx_hash, db.ipfs_hash = batch['timestamp'], batch['tx_hash'], batch['ipfs_hash']
+	for d in documents:
+		doc = LegacyDocument(d['path'], d['name'])
+		doc.hash = d['hash']
+		db.documents.append(doc)
+	return db
+
+def measure(build, n):
+	tracemalloc.start()
+	base = tracemalloc.get_traced_memory()[0]
+	objs = [build(r) for r in records(n)]
+	used = tracemalloc.get_traced_memory()[0] - base
+	tracemalloc.stop()
+	return used / n
+
+def materialized(record):
+	db = DocumentBatch.from_record(record)
+	db.documents
+	return db
+
+def run(n=20000):
+	return {
+		'legacy': measure(legacy, n),
+		'compact': measure(DocumentBatch.from_record, n),
+		'compact, documents loaded': measure(materialized, n),
+	}
+
+if __name__ == '__main__':
+	n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+	for name, size in run(n).items():
+		print('{:<26} {:8.0f} bytes/batch'.format(name, size))
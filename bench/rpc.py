@@ -0,0 +1,57 @@
+# Sidecar RPC latency benchmark: jsonrpyc polling calls vs the pipelined client
+# Usage: python -m bench.rpc [calls]
+# Requires node/ to have its npm packages installed, and jsonrpyc for the baseline
+import sys
+import time
+from subprocess import Popen, PIPE
+from mvc.utils.rpc import RPC
+
+method = 'pubkey-to-address'
+params = {'pubkey': '5a22a7e2bd5a6bb5b8b8ea3a19b4d6da2c7f1ba5c2a1c3b0a8e5d0f1e4b2c3d4'}
+
+def sidecar():
+	return Popen(["node", "./node/coz"], stdin=PIPE, stdout=PIPE, universal_newlines=True)
+
+def timed(func, calls):
+	start = time.perf_counter()
+	func(calls)
+	elapsed = time.perf_counter() - start
+	return elapsed / calls * 1000
+
+def run(calls=200):
+	results = {}
+
+	try:
+		sys.path.insert(0, './jsonrpyc')
+		import jsonrpyc
+	except ImportError:
+		jsonrpyc = None
+	if jsonrpyc:
+		proc = sidecar()
+		rpc = jsonrpyc.RPC(stdout=proc.stdin, stdin=proc.stdout)
+		rpc._i = 0
+		def blocking(n):
+			for i in range(n):
+				rpc(method, kwargs=params, block=0.1)
+		results['jsonrpyc'] = timed(blocking, calls)
+		proc.kill()
+
+	proc = sidecar()
+	rpc = RPC(stdout=proc.stdin, stdin=proc.stdout)
+	def sequential(n):
+		for i in range(n):
+			rpc(method, kwargs=params)
+	def pipelined(n):
+		futures = [rpc.call_async(method, kwargs=params) for i in range(n)]
+		for f in futures:
+			f.result()
+	results['sequential'] = timed(sequential, calls)
+	results['pipelined'] = timed(pipelined, calls)
+	proc.kill()
+
+	return results
+
+if __name__ == '__main__':
+	calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+	for name, ms in run(calls).items():
+		print('{:<12} {:10.3f} ms/call'.format(name, ms))
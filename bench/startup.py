@@ -0,0 +1,65 @@
+# Startup latency of the GUI: module imports, first paint of the main window, and time until
+# the background services (address book storage, node sidecar, IPFS connection) are up.
+# Each run starts a fresh interpreter; times are measured from just before it is spawned.
+# Usage: python -m bench.startup [runs]
+# Uses the offscreen Qt platform when no display is available. A missing sidecar or IPFS
+# daemon fails fast, so interactive times are only meaningful with both installed and running.
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+def child(t0):
+	if not os.environ.get('DISPLAY'):
+		os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+	marks = {}
+
+	from PyQt5 import QtCore
+	from mvc.controllers.Main import Main
+	marks['import'] = time.time() - t0
+
+	class Probe(Main):
+		def start_services(self):
+			tasks = super().start_services()
+			pending = set(tasks)
+			def finished(task):
+				pending.discard(task)
+				if not pending:
+					marks['interactive'] = time.time() - t0
+					self.app.quit()
+			for task in tasks:
+				task.signals.finished.connect(lambda task=task: finished(task))
+			return tasks
+
+	class PaintFilter(QtCore.QObject):
+		def eventFilter(self, obj, event):
+			if event.type() == QtCore.QEvent.Paint and 'first_paint' not in marks:
+				marks['first_paint'] = time.time() - t0
+			return False
+
+	app = Probe(sys.argv[:1])
+	marks['window'] = time.time() - t0
+	paint_filter = PaintFilter()
+	app.app.installEventFilter(paint_filter)
+	QtCore.QTimer.singleShot(30000, app.app.quit)
+	app.run()
+	print(json.dumps(marks))
+
+def run(runs=5):
+	samples = {}
+	for i in range(runs):
+		t0 = time.time()
+		out = subprocess.check_output([sys.executable, '-m', 'bench.startup', '--child', repr(t0)], stderr=subprocess.DEVNULL)
+		for name, value in json.loads(out.decode().strip().splitlines()[-1]).items():
+			samples.setdefault(name, []).append(value)
+	return {name: statistics.median(values) * 1000 for name, values in samples.items()}
+
+if __name__ == '__main__':
+	if len(sys.argv) > 2 and sys.argv[1] == '--child':
+		child(float(sys.argv[2]))
+	else:
+		runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+		for name, ms in run(runs).items():
+			print('{:<12} {:10.1f} ms'.format(name, ms))
@@ -0,0 +1,223 @@
+# End-to-end throughput against the in-process IPFS and NIS stand-ins in bench/fakes.py:
+# upload MB/s when sending a batch, transactions/s when refreshing, and download MB/s,
+# across document counts, file sizes and numbers of incoming batches.
+# Documents are random and so are stored uncompressed, except in the compression benchmark
+# which uploads CSV text. Convergent uploads are measured by sending the same documents twice,
+# the repeat skipping the upload. Whole-batch downloads are repeated with more and more files
+# fetched concurrently, which pays off most with --latency.
+# Usage: python -m bench.throughput [--quick] [--latency SECONDS] [--output FILE]
+# Run from the repository root. Requires node/ to have its npm packages installed;
+# the sidecar is pointed at the fake NIS through COZ_NIS_ENDPOINT.
+# Results are written as JSON, one entry per measurement, for tracking regressions.
+from pathlib import Path
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from .fakes import FakeIPFS, FakeNIS
+
+DOCUMENT_COUNTS = (1, 4, 16)
+FILE_SIZES = (64 << 10, 1 << 20, 8 << 20)
+BATCH_COUNTS = (10, 50, 200)
+DOWNLOAD_WORKERS = (1, 2, 4, 8)
+
+QUICK_DOCUMENT_COUNTS = (1, 4)
+QUICK_FILE_SIZES = (64 << 10, 1 << 20)
+QUICK_BATCH_COUNTS = (10,)
+QUICK_DOWNLOAD_WORKERS = (1, 4)
+
+def make_client(workdir, name, ipfs, nis):
+	from mvc.core.Client import Client
+	(workdir / name).mkdir()
+	client = Client(workdir / name / 'config')
+	client.ipfs_api = ipfs.address
+	key = workdir / name / 'key'
+	key.write_text(os.urandom(32).hex() + '\n')
+	client.load_privkey(key)
+	nis.register(client.account.pubkey, client.account.address)
+	if not client.init_ipfs():
+		raise RuntimeError('Cannot connect to the fake IPFS')
+	return client
+
+def make_documents(directory, count, size):
+	directory.mkdir(parents=True)
+	documents = []
+	for i in range(count):
+		path = directory / 'doc{}.bin'.format(i)
+		with path.open('wb') as f:
+			f.write(os.urandom(size))
+		documents.append({'path': path})
+	return documents
+
+# Batches are only accepted on refresh with an invoice
+def send(sender, receiver, documents, title):
+	invoice = documents[0]['path'].parent / 'invoice.csv'
+	if not invoice.exists():
+		invoice.write_text('item,amount\nbenchmark,0\n')
+	ok, res = sender.create_document_batch(invoice, {'title': title, 'receiver': receiver.account.address}, documents)
+	if not ok:
+		raise RuntimeError(res)
+	return res
+
+def bench_upload_download(workdir, sender, receiver, counts, sizes):
+	results = []
+	for count in counts:
+		for size in sizes:
+			total = count * size
+			documents = make_documents(workdir / 'upload-{}-{}'.format(count, size), count, size)
+
+			start = time.perf_counter()
+			db = send(sender, receiver, documents, 'upload {} x {}'.format(count, size))
+			elapsed = time.perf_counter() - start
+			results.append({'benchmark': 'upload', 'documents': count, 'file_size': size, 'seconds': elapsed, 'MB/s': total / elapsed / 1e6})
+
+			dest = workdir / 'download-{}-{}'.format(count, size)
+			dest.mkdir()
+			start = time.perf_counter()
+			sender.download_batch('out', db.tx_hash, dest)
+			elapsed = time.perf_counter() - start
+			results.append({'benchmark': 'download', 'documents': count, 'file_size': size, 'seconds': elapsed, 'MB/s': total / elapsed / 1e6})
+
+			for path in (workdir / 'upload-{}-{}'.format(count, size), dest):
+				shutil.rmtree(str(path))
+	return results
+
+def make_csv(path, size):
+	with path.open('w') as f:
+		i = 0
+		while f.tell() < size:
+			f.write('{},INV-{:08d},item {},{}.{:02d}\n'.format(i, i * 7919 % 10 ** 8, i % 97, i % 1000, i % 100))
+			i += 1
+
+def bench_download_workers(workdir, sender, receiver, worker_counts, count=8, size=1 << 20):
+	results = []
+	documents = make_documents(workdir / 'workers', count, size)
+	db = send(sender, receiver, documents, 'workers')
+	for workers in worker_counts:
+		sender.download_workers = workers
+		dest = workdir / 'workers-{}'.format(workers)
+		dest.mkdir()
+		start = time.perf_counter()
+		sender.download_batch('out', db.tx_hash, dest)
+		elapsed = time.perf_counter() - start
+		results.append({'benchmark': 'download workers', 'workers': workers, 'documents': count, 'file_size': size, 'seconds': elapsed, 'MB/s': count * size / elapsed / 1e6})
+		shutil.rmtree(str(dest))
+	del sender.download_workers
+	shutil.rmtree(str(workdir / 'workers'))
+	return results
+
+def bench_compression(workdir, ipfs, sender, receiver, sizes):
+	results = []
+	directory = workdir / 'compression'
+	directory.mkdir()
+	for size in sizes:
+		documents = [{'path': directory / 'invoice-{}.csv'.format(size)}]
+		make_csv(documents[0]['path'], size)
+		for compress in (False, True):
+			sender.compress = compress
+			stored = sum(len(data) for data in ipfs.files.values())
+			start = time.perf_counter()
+			db = send(sender, receiver, documents, 'compression {}'.format(size))
+			elapsed = time.perf_counter() - start
+			stored = sum(len(data) for data in ipfs.files.values()) - stored
+			results.append({'benchmark': 'upload csv' + (' compressed' if compress else ''), 'documents': 1, 'file_size': size, 'seconds': elapsed, 'MB/s': size / elapsed / 1e6, 'stored_bytes': stored})
+
+			dest = directory / 'download-{}-{}'.format(size, compress)
+			dest.mkdir()
+			start = time.perf_counter()
+			sender.download_batch('out', db.tx_hash, dest)
+			elapsed = time.perf_counter() - start
+			results.append({'benchmark': 'download csv' + (' compressed' if compress else ''), 'documents': 1, 'file_size': size, 'seconds': elapsed, 'MB/s': size / elapsed / 1e6})
+	sender.compress = True
+	shutil.rmtree(str(directory))
+	return results
+
+def bench_convergent(workdir, ipfs, sender, receiver, counts, sizes):
+	results = []
+	sender.convergent = True
+	for count in counts:
+		for size in sizes:
+			documents = make_documents(workdir / 'convergent-{}-{}'.format(count, size), count, size)
+			for attempt in ('first', 'repeat'):
+				stored = sum(len(data) for data in ipfs.files.values())
+				start = time.perf_counter()
+				send(sender, receiver, documents, 'convergent {} x {}'.format(count, size))
+				elapsed = time.perf_counter() - start
+				stored = sum(len(data) for data in ipfs.files.values()) - stored
+				results.append({'benchmark': 'convergent ' + attempt, 'documents': count, 'file_size': size, 'seconds': elapsed, 'MB/s': count * size / elapsed / 1e6, 'stored_bytes': stored})
+			shutil.rmtree(str(workdir / 'convergent-{}-{}'.format(count, size)))
+	sender.convergent = False
+	return results
+
+def bench_refresh(workdir, ipfs, nis, sender, batch_counts):
+	results = []
+	documents = make_documents(workdir / 'refresh-docs', 1, 1 << 10)
+	for n in batch_counts:
+		# A fresh recipient each time, so neither its ledger nor its metadata cache is warm
+		receiver = make_client(workdir, 'receiver-{}'.format(n), ipfs, nis)
+		# The recipient's public key is looked up from one of its outgoing transactions
+		nis.add_transfer(receiver.account.pubkey, sender.account.address)
+		for i in range(n):
+			send(sender, receiver, documents, 'refresh {}'.format(i))
+
+		start = time.perf_counter()
+		added = receiver.get_incoming_transactions()
+		elapsed = time.perf_counter() - start
+		if len(added) != n:
+			raise RuntimeError('Refresh found {} of {} batches: {}'.format(len(added), n, receiver.refresh_errors))
+		results.append({'benchmark': 'refresh', 'batches': n, 'seconds': elapsed, 'tx/s': n / elapsed})
+		receiver.close()
+	return results
+
+def run(quick=False, latency=0):
+	from mvc.utils import ciphers
+	counts, sizes, batches = (QUICK_DOCUMENT_COUNTS, QUICK_FILE_SIZES, QUICK_BATCH_COUNTS) if quick else (DOCUMENT_COUNTS, FILE_SIZES, BATCH_COUNTS)
+	workers = QUICK_DOWNLOAD_WORKERS if quick else DOWNLOAD_WORKERS
+	workdir = Path(tempfile.mkdtemp(prefix='coz-bench-'))
+	try:
+		with FakeIPFS(latency=latency) as ipfs, FakeNIS(latency=latency) as nis:
+			os.environ['COZ_NIS_ENDPOINT'] = nis.url
+			sender = make_client(workdir, 'sender', ipfs, nis)
+			receiver = make_client(workdir, 'receiver', ipfs, nis)
+			nis.add_transfer(receiver.account.pubkey, sender.account.address)
+
+			results = bench_upload_download(workdir, sender, receiver, counts, sizes)
+			results += bench_download_workers(workdir, sender, receiver, workers)
+			results += bench_compression(workdir, ipfs, sender, receiver, sizes)
+			results += bench_convergent(workdir, ipfs, sender, receiver, counts, sizes)
+			results += bench_refresh(workdir, ipfs, nis, sender, batches)
+			sender.close()
+			receiver.close()
+	finally:
+		shutil.rmtree(str(workdir), ignore_errors=True)
+
+	return {
+		'environment': {
+			'python': platform.python_version(),
+			'platform': platform.platform(),
+			'aes_backend': ciphers.get_backend().name,
+			'latency': latency,
+			'time': int(time.time()),
+		},
+		'results': results,
+	}
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(prog='python -m bench.throughput')
+	parser.add_argument('--quick', action='store_true', help='smaller grid, for a fast check')
+	parser.add_argument('--latency', type=float, default=0, help='seconds added to every fake IPFS and NIS request')
+	parser.add_argument('--output', help='write results to this file instead of stdout')
+	args = parser.parse_args()
+
+	res = run(args.quick, args.latency)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(res, f, indent=2)
+	else:
+		json.dump(res, sys.stdout, indent=2)
+		print()
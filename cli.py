@@ -0,0 +1,7 @@
+#!/usr/bin/python
+# Command line interface, see mvc/__main__.py
+import sys
+sys.path.insert(0,"./packages.zip")
+from mvc.__main__ import main
+
+sys.exit(main())
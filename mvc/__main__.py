@@ -0,0 +1,106 @@
+# Command line interface, for use without a display. Started through cli.py in a release:
+#   python -m mvc --key KEYFILE send --to ADDRESS --title TITLE [--invoice FILE] [--convergent] [--no-compress] FILE...
+#   python -m mvc --key KEYFILE refresh
+#   python -m mvc --key KEYFILE list [--direction in|out] [--offset N] [--limit N]
+#   python -m mvc --key KEYFILE download [--direction in|out] [--workers N] TX_HASH DEST
+# Results are printed to stdout as JSON. Qt is never imported.
+# --trace FILE writes IPFS, RPC and crypto timings to FILE, see mvc/utils/tracing.py.
+from pathlib import Path
+import argparse
+import json
+import logging
+import sys
+
+def record_json(record):
+	batch, documents = record
+	return dict(batch, documents=documents)
+
+def cmd_send(client, args):
+	client.convergent = args.convergent
+	client.compress = args.compress
+	documents = [{'path': Path(path)} for path in args.files]
+	invoice = Path(args.invoice) if args.invoice else None
+	ok, res = client.create_document_batch(invoice, {'title': args.title, 'receiver': args.to}, documents)
+	if not ok:
+		raise RuntimeError(res)
+	return record_json(res.to_record())
+
+def cmd_refresh(client, args):
+	added = client.get_incoming_transactions()
+	return {
+		'added': [record_json(db.to_record()) for db in added],
+		'errors': {tx_hash: str(e) for tx_hash, e in client.refresh_errors.items()},
+	}
+
+def cmd_list(client, args):
+	return [record_json(record) for record in client.ledger.load(args.direction, args.offset, args.limit)]
+
+def cmd_download(client, args):
+	client.download_workers = args.workers
+	return {'path': client.download_batch(args.direction, args.tx_hash, args.dest)}
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(prog='python -m mvc')
+	parser.add_argument('--key', required=True, help='file containing the NEM private key')
+	parser.add_argument('--config', default='./.config', help='configuration and storage directory')
+	parser.add_argument('--trace', metavar='FILE', help='write call timings and histograms to this metrics file')
+	parser.add_argument('-v', '--verbose', action='store_true')
+	commands = parser.add_subparsers(dest='command')
+	commands.required = True
+
+	cmd = commands.add_parser('send', help='upload documents and announce them to a recipient')
+	cmd.set_defaults(func=cmd_send, ipfs=True)
+	cmd.add_argument('--to', required=True, help='recipient address')
+	cmd.add_argument('--title', required=True, help='invoice number')
+	cmd.add_argument('--invoice', help='invoice data file')
+	cmd.add_argument('--convergent', action='store_true', help='derive document keys from their content, so repeated documents are uploaded once')
+	cmd.add_argument('--no-compress', dest='compress', action='store_false', help='store documents without compressing them first')
+	cmd.add_argument('files', nargs='*')
+
+	cmd = commands.add_parser('refresh', help='fetch incoming document batches')
+	cmd.set_defaults(func=cmd_refresh, ipfs=True)
+
+	cmd = commands.add_parser('list', help='list stored document batches, newest first')
+	cmd.set_defaults(func=cmd_list, ipfs=False)
+	cmd.add_argument('--direction', choices=('in', 'out'), default='in')
+	cmd.add_argument('--offset', type=int, default=0)
+	cmd.add_argument('--limit', type=int, default=-1)
+
+	cmd = commands.add_parser('download', help='download a stored document batch')
+	cmd.set_defaults(func=cmd_download, ipfs=True)
+	cmd.add_argument('--direction', choices=('in', 'out'), default='in')
+	cmd.add_argument('--workers', type=int, default=4, help='files downloaded concurrently')
+	cmd.add_argument('tx_hash')
+	cmd.add_argument('dest')
+
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	args = parse_args(argv)
+	logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+
+	if args.trace:
+		from .utils import tracing
+		tracing.enable(args.trace)
+
+	from .core.Client import Client
+	client = Client(args.config)
+	try:
+		client.load_privkey(args.key)
+		if args.ipfs and not client.init_ipfs():
+			raise RuntimeError('Cannot connect to IPFS')
+		res = args.func(client, args)
+	except Exception as e:
+		logging.debug('Command failed', exc_info=True)
+		json.dump({'error': '{}: {}'.format(type(e).__name__, e)}, sys.stdout)
+		print()
+		return 1
+	finally:
+		client.close()
+
+	json.dump(res, sys.stdout, indent=2)
+	print()
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -1,15 +1,20 @@
 from ..views.Main import Main as MainView
 from ..models import DocumentBatch, AddressBook
-from ..utils import Account, NEM, Storage
+from ..core.Client import Client
+from ..utils import NullTask
+from ..utils.tasks import TaskRunner
 import logging
-import ipfsapi
 import PyQt5
+from PyQt5 import QtCore
 
 logging.basicConfig(level=logging.DEBUG)
 
-class Main():
+class Main(Client):
 	def __init__(self, argv):
 		self.app = PyQt5.QtWidgets.QApplication(argv)
+		# Network work runs here, off the GUI thread
+		self.tasks = TaskRunner()
+		self.refresh_task = None
 
 		self.docbatch_model_send = DocumentBatch.DocumentBatchModel()
 		self.docbatch_model_recv = DocumentBatch.DocumentBatchModel()
@@ -17,16 +22,24 @@ class Main():
 		self.docbatch_model_recv.alias_func = self.get_alias
 
 		self.address_book = AddressBook.AddressBookModel()
+		self.address_book.aliasesChanged.connect(self.refresh_docbatch_aliases)
 
-		self.nem = NEM()
 		self.view = None
-		self.account = Account()
-
-		self.load_addressbook_storage()
+		super().__init__()
 
 		self.view = MainView(self)
 
-		self.init_ipfs()
+		# Storage, the sidecar and IPFS are brought up in the background once the window is shown
+		self.startup_tasks = []
+		QtCore.QTimer.singleShot(0, self.start_services)
+
+	def start_services(self):
+		self.startup_tasks = [
+			self.tasks.start(self.load_addressbook_storage),
+			self.tasks.start(lambda task: self.nem.start()),
+			self.init_ipfs(),
+		]
+		return self.startup_tasks
 
 	@property
 	def account_label(self):
@@ -40,15 +53,15 @@ class Main():
 	def account_label_updated(self):
 		if self.view:
 			self.view.update(account=True)
-			self.refresh_docbatch_aliases()
+			self.refresh_docbatch_aliases({self.account.address})
 
 	def update_address_book(self):
-		self.address_book.storage.save()
-		self.refresh_docbatch_aliases()
+		if self.address_book.storage.initialized:
+			self.address_book.storage.save()
 
-	def refresh_docbatch_aliases(self):
-		self.docbatch_model_send.refresh_aliases()
-		self.docbatch_model_recv.refresh_aliases()
+	def refresh_docbatch_aliases(self, addresses=None):
+		self.docbatch_model_send.refresh_aliases(addresses)
+		self.docbatch_model_recv.refresh_aliases(addresses)
 
 	def get_alias(self, addr):
 		if addr == self.account.address:
@@ -58,98 +71,82 @@ class Main():
 			alias = addr if alias is None else alias
 		return alias
 
-	def init_config_dir(self):
-		from pathlib import Path
-		config_dir = Path('./.config') # Todo: use XDG
-		config_dir.mkdir(exist_ok=True)
-		return config_dir
-
-	def load_addressbook_storage(self):
+	# The shelve is opened on a worker thread and loaded into the model on the GUI thread
+	def load_addressbook_storage(self, task=None):
 		import shelve
+		task = task or NullTask()
 		storage_dir = self.init_config_dir()
 		addrbook = shelve.open(str(storage_dir / 'addrbook.db'))
-		self.address_book.storage.set_shelve(addrbook, 'entries')
-		self.address_book.storage.load()
+		task.post(self.address_book.storage.set_shelve, addrbook, 'entries')
+		task.post(self.address_book.storage.load)
 
 	def load_account_storage(self):
-		import shelve
-		storage_dir = self.init_config_dir()
-		account = shelve.open(str(storage_dir / '{}.db'.format(self.account.address)))
-
-		self.account.storage.set_shelve(account, 'label')
-		self.account.storage.load()
-
-		self.docbatch_model_send.storage.set_shelve(account, 'txs_out')
-		self.docbatch_model_send.clear()
-		self.docbatch_model_send.storage.load()
-		self.docbatch_model_recv.storage.set_shelve(account, 'txs_in')
-		self.docbatch_model_recv.clear()
-		self.docbatch_model_recv.storage.load()
+		super().load_account_storage()
+		self.docbatch_model_send.setLedger(self.ledger, 'out')
+		self.docbatch_model_recv.setLedger(self.ledger, 'in')
 
 	def run(self):
-		return self.app.exec_()
+		res = self.app.exec_()
+		self.tasks.cancel_all()
+		self.tasks.wait()
+		return res
 
+	# Key derivation waits for the sidecar, the account is switched on the GUI thread
 	def load_privkey(self, path):
-		old = self.account.address
-		privkey = open(str(path)).readline().strip()
-		self.account.storage.close()
-		self.account = Account.from_privkey(privkey, self.nem)
-
-		if old != self.account.address:
-			self.load_account_storage()
+		task = self.tasks.start(lambda task: self.read_account(path))
+		task.signals.result.connect(self.set_account)
+		return task
+
+	# A running refresh is cancelled, what it stored so far stays in the ledger of the previous account
+	def set_account(self, account):
+		if super().set_account(account):
+			if self.refresh_task:
+				self.refresh_task.cancel()
 			self.account_label_updated()
 
 	def init_ipfs(self):
-		try:
-			self.ipfs = ipfsapi.connect('127.0.0.1', 5001)
-		except ipfsapi.exceptions.ConnectionError as e:
-			logging.warning(e)
-			self.ipfs = None
-
-		self.view.set_ipfs_ok(self.ipfs is not None)
-
-	def get_incoming_transactions(self):
-		txs = self.account.get_incoming_transactions(self.nem)
-		dbs = []
-		model = self.docbatch_model_recv
-		hash_column = model.findColumn('Hash')
-		skip_txs = set(model.index(r, hash_column).data() for r in range(model.rowCount()))
-		for tx in txs['data']:
-			if tx['meta']['hash']['data'] in skip_txs: continue
-			db = DocumentBatch.DocumentBatch.from_transaction(self.account, tx, self.nem, self.ipfs)
-			dbs.append(db)
-
-		model.appendData(dbs)
-		date_column = model.findColumn('Date')
-		model.sort(date_column, PyQt5.QtCore.Qt.DescendingOrder)
-		model.storage.save()
-
-	def create_document_batch(self, invoice, kwargs, documents=[]):
-		db = DocumentBatch.DocumentBatch(sender=self.account.address, **kwargs)
-
-		for d_kwargs in documents:
-			d = DocumentBatch.Document(**d_kwargs)
-			db.add_document(d)
-
-		recv_pubkey = self.nem.find_pubkey_from_address(db.receiver)
-		if recv_pubkey:
-			acc_recv = Account.from_pubkey(recv_pubkey, self.nem)
-			db.upload(self.account, acc_recv, self.nem, self.ipfs, invoice)
-
-			model = self.docbatch_model_send
-			model.appendData([db])
-			date_column = model.findColumn('Date')
-			model.sort(date_column, PyQt5.QtCore.Qt.DescendingOrder)
-			model.storage.save()
-			return True, None
-		else:
-			return False, "Recipient pubkey not found"
-
+		task = self.tasks.start(lambda task: Client.init_ipfs(self))
+		task.signals.result.connect(self.view.set_ipfs_ok)
+		return task
+
+	# Batches reach the models, and through them the ledger, on the GUI thread.
+	# Batches of an account no longer shown are only saved to its ledger.
+	def store_batch(self, account, direction, db, task, saved=None):
+		def store():
+			if account is not self.account:
+				self.save_records(account, direction, [db.to_record()])
+			else:
+				model = self.docbatch_model_recv if direction == 'in' else self.docbatch_model_send
+				model.addBatches([db])
+			if saved:
+				saved()
+		task.post(store)
+
+	# Start a refresh in the background, unless one is already running
+	def refresh_incoming(self):
+		if self.refresh_task:
+			return None
+		task = self.tasks.start(self.get_incoming_transactions)
+		self.refresh_task = task
+		def finished():
+			self.refresh_task = None
+		task.signals.finished.connect(finished)
+		return task
+
+	def send_document_batch(self, invoice, kwargs, documents=[]):
+		return self.tasks.start(self.create_document_batch, invoice, kwargs, documents)
+
+	# Rows are resolved here on the GUI thread, the transfers run as tasks
 	def download_docbatch(self, model, index, dest):
-		return model.download_docbatch(index, dest, self.ipfs)
+		db = model.rowData(index.row())
+		if not (db.ipfs_hash and db.tx_hash):
+			raise ValueError('Invalid document batch')
+		return self.tasks.start(lambda task: db.download(self.ipfs, dest, task.progress, self.download_workers))
 
 	def download_document(self, model, index1, index2, dest):
-		model.download_document(index1, index2, dest, self.ipfs)
+		db = model.rowData(index1.row())
+		doc = model.document_model.rowData(index2.row())
+		return self.tasks.start(lambda task: db.download_document(self.ipfs, doc, dest, task.byte_counter(doc.size, doc.name)))
 
 	def _debug(self):
 		from pathlib import Path
@@ -159,4 +156,5 @@ class Main():
 		}
 		invoice = Path('../data/invoice.csv')
 		docs = [{'path':Path('../data/test1.txt')}]
-		self.create_document_batch(invoice, docbatch, docs)
+		task = self.send_document_batch(invoice, docbatch, docs)
+		self.view.track_task(task, 'Sending test transaction', self.view.document_batch_sent)
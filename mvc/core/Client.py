@@ -0,0 +1,262 @@
+from pathlib import Path
+import io
+from .DocumentBatch import DocumentBatch, Document
+from ..utils import Account, NEM, NullTask, TransactionSync
+from ..utils.cache import MetadataCache, CachedIPFS
+from ..utils.journal import UploadJournal
+from ..utils.ledger import Ledger
+from ..utils import tracing
+import logging
+import pickle
+
+class LegacyUnpickler(pickle.Unpickler):
+	# Batches pickled by older versions name the Qt models module, which would import PyQt5
+	def find_class(self, module, name):
+		if module == 'mvc.models.DocumentBatch':
+			module = DocumentBatch.__module__
+		return super().find_class(module, name)
+
+class Client():
+	# Account state and network operations, without any Qt dependency.
+	# Used directly by the command line and extended by the GUI controller.
+
+	# Maximum number of documents uploaded concurrently per batch
+	upload_workers = 4
+	# Maximum number of files downloaded concurrently per batch
+	download_workers = 4
+	# Maximum number of incoming transactions resolved concurrently on refresh
+	refresh_workers = 8
+	# Host and port of the IPFS HTTP API
+	ipfs_api = ('127.0.0.1', 5001)
+	# Derive document keys from their content, so repeated attachments are stored once.
+	# The secret in convergent.key should be shared by every sender of the same organization.
+	convergent = False
+	# Compress documents before encryption, unless they are compressed already
+	compress = True
+
+	def __init__(self, config_dir='./.config'):
+		self.config_dir = Path(config_dir) # Todo: use XDG
+		self.nem = NEM()
+		self.account = Account()
+		self.ipfs = None
+		self.ledger = None
+		# Errors from the last refresh, by transaction hash
+		self.refresh_errors = {}
+		self.sync_in = TransactionSync('incoming', 'ipfs')
+		# Opened along with the IPFS connection
+		self.ipfs_cache = None
+
+	def init_config_dir(self):
+		self.config_dir.mkdir(exist_ok=True)
+		return self.config_dir
+
+	def load_account_storage(self):
+		import shelve
+		storage_dir = self.init_config_dir()
+		account = shelve.open(str(storage_dir / '{}.db'.format(self.account.address)))
+
+		self.account.storage.set_shelve(account, 'label')
+		self.account.storage.load()
+
+		if self.ledger:
+			self.ledger.close()
+		self.ledger = Ledger(self.ledger_path(self.account.address))
+		for key, direction in (('txs_out', 'out'), ('txs_in', 'in')):
+			# One-time migration of batch lists pickled into the shelve by older versions
+			if key in account:
+				data = account.dict[key.encode(account.keyencoding)]
+				dbs = LegacyUnpickler(io.BytesIO(data)).load()
+				self.ledger.save(direction, [db.to_record() for db in dbs])
+				del account[key]
+
+		self.sync_in.storage.set_shelve(account, 'sync_in')
+		self.sync_in.storage.load_default(None)
+
+	def ledger_path(self, address):
+		return self.init_config_dir() / '{}.sqlite'.format(address)
+
+	# Secret for convergent encryption, created on first use
+	def convergent_secret(self):
+		import os
+		path = self.init_config_dir() / 'convergent.key'
+		if not path.exists():
+			path.write_text(os.urandom(32).hex() + '\n')
+		return bytes.fromhex(path.read_text().strip())
+
+	# Account of a private key file, needs the sidecar
+	def read_account(self, path):
+		privkey = open(str(path)).readline().strip()
+		return Account.from_privkey(privkey, self.nem)
+
+	# Returns whether the account changed
+	def set_account(self, account):
+		old = self.account.address
+		self.account.storage.close()
+		self.account = account
+
+		if old != self.account.address:
+			self.load_account_storage()
+			return True
+		return False
+
+	def load_privkey(self, path):
+		return self.set_account(self.read_account(path))
+
+	def init_ipfs(self):
+		import ipfsapi
+		if self.ipfs_cache is None:
+			self.ipfs_cache = MetadataCache(self.init_config_dir() / 'ipfs-cache.sqlite')
+		try:
+			self.ipfs = CachedIPFS(tracing.Traced(ipfsapi.connect(*self.ipfs_api), 'ipfs'), self.ipfs_cache)
+		except ipfsapi.exceptions.ConnectionError as e:
+			logging.warning(e)
+			self.ipfs = None
+
+		return self.ipfs is not None
+
+	def close(self):
+		self.account.storage.close()
+		if self.ledger:
+			self.ledger.close()
+		if self.ipfs_cache:
+			self.ipfs_cache.close()
+
+	# Save records to the ledger of account. A task may finish after another account was loaded,
+	# its batches then go to the ledger they were fetched or sent for.
+	def save_records(self, account, direction, records):
+		if account is self.account:
+			self.ledger.save(direction, records)
+			return
+		ledger = Ledger(self.ledger_path(account.address))
+		try:
+			ledger.save(direction, records)
+		finally:
+			ledger.close()
+
+	# Record a new batch of account, direction is 'in' or 'out'. saved is called once it is in the ledger.
+	def store_batch(self, account, direction, db, task, saved=None):
+		self.save_records(account, direction, [db.to_record()])
+		if saved:
+			saved()
+
+	# The sync state is kept in the account storage, which is closed once another account is loaded.
+	# Batches already stored are skipped by the next refresh of that account.
+	def update_sync(self, account, func, *args):
+		if account is self.account:
+			func(*args)
+
+	# Returns the batches added.
+	# Transactions which failed before are tried again first. Then the new ones are resolved page by
+	# page as the history is read, and the sync progress is committed once a page is handled.
+	def get_incoming_transactions(self, task=None):
+		from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+		task = task or NullTask()
+		# Results belong to the account current at the start, even if another one is loaded meanwhile
+		account = self.account
+		sync = self.sync_in
+		retry = dict(sync.retry)
+
+		self.refresh_errors = {}
+		added = []
+		# Future to (transaction, page), pages are [transactions pending, sync progress] in history order
+		futures = {}
+		pages = []
+		done = 0
+
+		def submit(tx, page=None):
+			if self.ledger.has_transaction('in', tx['hash']):
+				if tx['hash'] in retry:
+					task.post(self.update_sync, account, sync.succeeded, tx)
+				return
+			if page:
+				page[0] += 1
+			futures[pool.submit(DocumentBatch.from_transaction, account, tx, self.nem, self.ipfs)] = (tx, page)
+
+		# Batches are stored as soon as they are ready, and failures kept for the next refreshes
+		def collect(finished):
+			nonlocal done
+			for future in finished:
+				tx, page = futures.pop(future)
+				try:
+					db = future.result()
+				except Exception as e:
+					logging.exception('Error when processing transaction {}'.format(tx['hash']))
+					self.refresh_errors[tx['hash']] = e
+					attempts = retry[tx['hash']][1] + 1 if tx['hash'] in retry else 1
+					task.post(self.update_sync, account, sync.failed, tx, attempts)
+				else:
+					self.store_batch(account, 'in', db, task)
+					added.append(db)
+					if tx['hash'] in retry:
+						task.post(self.update_sync, account, sync.succeeded, tx)
+				if page:
+					page[0] -= 1
+				done += 1
+				task.progress(done, done + len(futures), tx['hash'])
+
+			# Progress is committed in history order, after the batches above were stored
+			while pages and pages[0][0] == 0:
+				task.post(self.update_sync, account, sync.advance, *pages.pop(0)[1])
+
+		with ThreadPoolExecutor(self.refresh_workers) as pool:
+			try:
+				for tx, attempts in retry.values():
+					submit(tx)
+				for txs, top, low, last in sync.pages(self.nem, account.address, account.privkey):
+					page = [0, (top, low, last)]
+					pages.append(page)
+					for tx in txs:
+						if tx['hash'] not in retry:
+							submit(tx, page)
+					collect([f for f in list(futures) if f.done()])
+				while futures:
+					finished, pending = wait(futures, return_when=FIRST_COMPLETED)
+					collect(finished)
+			finally:
+				# Unfinished pages are read again on the next refresh
+				for future in futures:
+					future.cancel()
+
+		return added
+
+	# Journal of a send, found again by a retry with the same recipient, title, files and options
+	def upload_journal(self, db, invoice):
+		files = [d.path for d in db.documents] + ([invoice] if invoice else [])
+		name = UploadJournal.batch_id(db.sender, db.receiver, db.title, [d.name for d in db.documents], self.convergent, self.compress, files=files)
+		return UploadJournal(self.init_config_dir() / 'uploads' / (name + '.json'))
+
+	# Returns (True, batch) once announced, or (False, reason).
+	# An interrupted send resumes when retried, see upload_journal.
+	def create_document_batch(self, invoice, kwargs, documents=[], task=None):
+		task = task or NullTask()
+		account = self.account
+		db = DocumentBatch(sender=account.address, **kwargs)
+
+		for d_kwargs in documents:
+			d = Document(**d_kwargs)
+			db.add_document(d)
+
+		recv_pubkey = self.nem.find_pubkey_from_address(db.receiver)
+		if recv_pubkey:
+			acc_recv = Account.from_pubkey(recv_pubkey, self.nem)
+			def progress(doc, done, total):
+				logging.info('Uploaded {} ({}/{})'.format(doc.name, done, total))
+				task.progress(done, total, doc.name)
+			secret = self.convergent_secret() if self.convergent else None
+			journal = self.upload_journal(db, invoice)
+			db.upload(account, acc_recv, self.nem, self.ipfs, invoice, max_workers=self.upload_workers, progress=progress, convergent=secret, index=self.ipfs_cache, compress=self.compress, journal=journal)
+
+			# The journal is kept until the batch is in the ledger
+			self.store_batch(account, 'out', db, task, journal.remove)
+			return True, db
+		else:
+			return False, "Recipient pubkey not found"
+
+	# Download a stored batch by transaction hash, returns the directory written
+	def download_batch(self, direction, tx_hash, dest, task=None):
+		task = task or NullTask()
+		record = self.ledger.find(direction, tx_hash)
+		if record is None:
+			raise KeyError('Unknown transaction {}'.format(tx_hash))
+		db = DocumentBatch.from_record(record)
+		return db.download(self.ipfs, dest, task.progress, self.download_workers)
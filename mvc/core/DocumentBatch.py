@@ -0,0 +1,810 @@
+from pathlib import Path
+import io
+import os
+import sys
+import datetime
+import time
+import logging
+import json
+
+from ..utils import tracing
+from ..utils.journal import AnnouncementPending, UploadJournal
+
+class CipherStream(io.RawIOBase):
+	# Read-only file object which applies func to an underlying stream chunk by chunk
+	def __init__(self, fp, func):
+		super().__init__()
+		self.fp = fp
+		self.func = func
+		self.pos = fp.tell() if fp.seekable() else 0
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return self.fp.seekable()
+
+	# Seeking is only meant for probing the size, which ipfsapi does before an upload.
+	# func keeps state across chunks, so reading must resume where it left off.
+	def seek(self, offset, whence=io.SEEK_SET):
+		return self.fp.seek(offset, whence)
+
+	def tell(self):
+		return self.fp.tell()
+
+	def readinto(self, buf):
+		if self.seekable() and self.fp.tell() != self.pos:
+			raise io.UnsupportedOperation('cannot read from a different position')
+		data = self.fp.read(len(buf))
+		if not data:
+			return 0
+		data = self.func(data)
+		buf[:len(data)] = data
+		self.pos += len(data)
+		return len(data)
+
+	def close(self):
+		self.fp.close()
+		super().close()
+
+class EncryptionMethods():
+	# Size of chunks read from disk and handed to ipfs.add
+	chunk_size = 1 << 16
+
+	class Base():
+		def __init__(self, key=None):
+			self.key = None
+
+		@classmethod
+		def genkey(cls):
+			return None
+
+		# Continue at offset in the plaintext, for decrypting a stream from the middle
+		def seek(self, offset):
+			pass
+
+		# Encrypted view of fp, suitable for passing to ipfs.add
+		def encrypt_stream(self, fp):
+			return io.BufferedReader(CipherStream(fp, self.encrypt), EncryptionMethods.chunk_size)
+
+		# Decrypt an iterable of ciphertext chunks, writing plaintext to fp as it arrives.
+		# progress(size) is called after each chunk and may raise to abort.
+		def decrypt_stream(self, chunks, fp, progress=None):
+			for chunk in chunks:
+				fp.write(self.decrypt(chunk))
+				if progress:
+					progress(len(chunk))
+
+	class Dummy(Base):
+		def encrypt(self, data):
+			return data
+
+		def decrypt(self, data):
+			return data
+
+	class AES(Base):
+		import os
+		from ..utils import ciphers
+
+		# Name of the AES-CTR backend to use, None selects the fastest one installed
+		backend = None
+
+		def __init__(self, key=None, backend=None):
+			self.key = key or self.genkey()
+			self.backend_cls = self.ciphers.get_backend(backend or self.backend)
+			self.mode = self.backend_cls(self.key)
+
+		@classmethod
+		def genkey(cls):
+			return cls.os.urandom(32)
+
+		# CTR output is the same length as its input
+		def encrypt(self, data):
+			with tracing.span('aes.encrypt', len(data)) as span:
+				span.bytes_out = len(data)
+				return self.mode.encrypt(data)
+
+		def decrypt(self, data):
+			with tracing.span('aes.decrypt', len(data)) as span:
+				span.bytes_out = len(data)
+				return self.mode.decrypt(data)
+
+		def seek(self, offset):
+			self.mode = self.backend_cls(self.key, offset)
+
+class CompressionMethods():
+	# Applied before encryption, ciphertext does not compress.
+	# The codec of each file is recorded by name in the batch manifest.
+
+	# Files whose first chunk does not shrink below this ratio are stored as they are
+	min_ratio = 0.9
+	# Formats which are compressed already
+	skip_suffixes = {'.7z', '.bz2', '.docx', '.gif', '.gz', '.jpeg', '.jpg', '.mp3', '.mp4', '.odp', '.ods', '.odt', '.png', '.pptx', '.xlsx', '.xz', '.zip'}
+
+	class Zlib():
+		import zlib
+		name = 'zlib'
+		level = 6
+
+		# Compressed copy of fp in a temporary file. ipfs.add needs to know the size before sending.
+		@classmethod
+		def compress(cls, fp):
+			import tempfile
+			out = tempfile.TemporaryFile()
+			compressor = cls.zlib.compressobj(cls.level)
+			for chunk in iter(lambda: fp.read(EncryptionMethods.chunk_size), b''):
+				out.write(compressor.compress(chunk))
+			out.write(compressor.flush())
+			out.seek(0)
+			return out
+
+		@classmethod
+		def decompressor(cls, fp):
+			return Decompressor(fp, cls.zlib.decompressobj())
+
+	@classmethod
+	def get(cls, name):
+		if name is None:
+			return None
+		if name == cls.Zlib.name:
+			return cls.Zlib
+		raise ValueError('Unknown compression {}'.format(name))
+
+	# Codec for a file, or None when compression would not pay off
+	@classmethod
+	def choose(cls, path):
+		if path.suffix.lower() in cls.skip_suffixes:
+			return None
+		with path.open('rb') as fp:
+			sample = fp.read(EncryptionMethods.chunk_size)
+		if sample and len(cls.Zlib.zlib.compress(sample, 1)) < len(sample) * cls.min_ratio:
+			return cls.Zlib
+		return None
+
+class Decompressor():
+	# Write-only file object which decompresses into fp, in bounded pieces
+	def __init__(self, fp, obj):
+		self.fp = fp
+		self.obj = obj
+
+	def write(self, data):
+		while data:
+			self.fp.write(self.obj.decompress(data, EncryptionMethods.chunk_size))
+			data = self.obj.unconsumed_tail
+
+	def flush(self):
+		self.fp.write(self.obj.flush())
+		if not self.obj.eof:
+			raise ValueError('Compressed data is truncated')
+
+# Compressed and encrypted view of a file, as stored in IPFS
+def upload_stream(path, enc, codec=None):
+	fp = path.open('rb')
+	if codec:
+		with fp:
+			fp = codec.compress(fp)
+	return enc.encrypt_stream(fp)
+
+# Errors worth retrying later: the IPFS daemon could not be reached or did not answer in time.
+# Anything else, such as a missing link or a hash that does not resolve, is final.
+def is_transient(e):
+	import ipfsapi
+	return isinstance(e, (OSError, ipfsapi.exceptions.ConnectionError, ipfsapi.exceptions.TimeoutError, ipfsapi.exceptions.ProtocolError))
+
+# Checked locally, unlike object_stat which would search the network for a missing block
+def is_pinned(ipfs, _hash):
+	try:
+		return _hash in ipfs.pin_ls('all', args=(_hash,))['Keys']
+	except Exception:
+		return False
+
+# With resume, data is written to dest.part and renamed once complete. A partial file left by an
+# interrupted download is continued from its last whole chunk, the one after may be torn.
+# Compressed files are fetched again from the start, the decompressor cannot pick up midway.
+def download_stream(ipfs, path, dest, enc, progress=None, codec=None, resume=False):
+	dest = Path(dest)
+	part = dest.with_name(dest.name + '.part') if resume else dest
+	offset = 0
+	if resume and not codec and part.exists():
+		chunk_size = EncryptionMethods.chunk_size
+		offset = max(0, part.stat().st_size - chunk_size) // chunk_size * chunk_size
+
+	with part.open('r+b' if offset else 'wb') as fp:
+		if offset:
+			fp.truncate(offset)
+			fp.seek(offset)
+			enc.seek(offset)
+			if progress:
+				progress(offset)
+			chunks = ipfs.cat(path, stream=True, opts={'offset': offset})
+		else:
+			chunks = ipfs.cat(path, stream=True)
+		out = codec.decompressor(fp) if codec else fp
+		enc.decrypt_stream(chunks, out, progress)
+		if codec:
+			out.flush()
+	if resume:
+		os.replace(str(part), str(dest))
+
+# Exclusive use of a download folder, through a .lock file created with O_EXCL that holds the pid.
+# A lock left by a process which no longer runs is taken over, this is only checked on POSIX.
+def lock_folder(path):
+	lock = path / '.lock'
+	while True:
+		try:
+			fd = os.open(str(lock), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except FileExistsError:
+			if not _lock_is_stale(lock):
+				return False
+			try:
+				lock.unlink()
+			except FileNotFoundError:
+				pass
+			continue
+		with os.fdopen(fd, 'w') as f:
+			f.write(str(os.getpid()))
+		return True
+
+def _lock_is_stale(lock):
+	if os.name != 'posix':
+		return False
+	try:
+		pid = int(lock.read_text())
+	except (FileNotFoundError, ValueError):
+		# Missing, or still being written by its holder
+		return False
+	if pid == os.getpid():
+		return False
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return True
+	except PermissionError:
+		pass
+	return False
+
+def unlock_folder(path):
+	try:
+		(path / '.lock').unlink()
+	except FileNotFoundError:
+		pass
+
+class Directory():
+	# Collects the links of a unixfs directory locally, then stores it with a single object_put
+	def __init__(self):
+		self.links = {}
+
+	def add_link(self, name, _hash, size):
+		self.links[name] = (_hash, int(size))
+
+	def add_data(self, ipfs, name, data):
+		if isinstance(data, bytes):
+			data = io.BytesIO(data)
+		res = ipfs.add(data, pin=False)
+		self.add_link(name, res['Hash'], res['Size'])
+
+	def put(self, ipfs):
+		import json
+		# Links are sorted by name, as IPFS does when encoding a directory node
+		node = {
+			'Data': '\x08\x01', # unixfs directory
+			'Links': [{'Name': name, 'Hash': _hash, 'Size': size} for name, (_hash, size) in sorted(self.links.items())],
+		}
+		res = ipfs.object_put(io.BytesIO(json.dumps(node).encode()))
+		logging.debug(res)
+		return res
+
+class Document():
+	# Slotted to keep large histories compact; the path is held as a plain string
+	__slots__ = ('_path', 'name', 'hash', 'size')
+
+	def __init__(self, path, name=None):
+		self.path = path
+		self.name = name if name else self.path.name
+		self.hash = ''
+		self.size = None
+
+	@property
+	def path(self):
+		return Path(self._path)
+	@path.setter
+	def path(self, value):
+		self._path = str(value)
+
+	# Pickled as a dict of public attributes, the same state as before slots were used
+	def __getstate__(self):
+		return {'path': self.path, 'name': self.name, 'hash': self.hash, 'size': self.size}
+
+	def __setstate__(self, state):
+		self.__init__(state['path'], state['name'])
+		self.hash = state.get('hash', '')
+		self.size = state.get('size')
+
+	# Returns the hash, the key and the name of the compression used, if any.
+	# codec is chosen here with compress, or may be given instead.
+	def upload(self, ipfs, encrypt_cls, key, pin=True, compress=False, codec=None):
+		enc = encrypt_cls(key)
+		if compress and codec is None:
+			codec = CompressionMethods.choose(self.path)
+		with upload_stream(self.path, enc, codec) as data:
+			res = ipfs.add(data, pin=pin)
+		logging.debug(res)
+		self.hash = res['Hash']
+		self.size = int(res['Size'])
+
+		return self.hash, enc.key, codec and codec.name
+
+	# Key derived from the content and a shared secret, so identical files encrypt to identical blocks.
+	# The codec is part of it: the compressed and the plain form of a file must never share a keystream.
+	def convergent_key(self, secret, codec=None):
+		import hashlib
+		import hmac
+		digest = hashlib.sha256()
+		with self.path.open('rb') as fp:
+			for chunk in iter(lambda: fp.read(EncryptionMethods.chunk_size), b''):
+				digest.update(chunk)
+		data = digest.digest()
+		if codec:
+			data += codec.name.encode()
+		return hmac.new(secret, data, hashlib.sha256).digest()
+
+	# Upload with a convergent key, skipped when the same content is already pinned.
+	# index maps a digest of the key to the hash, size and compression of the earlier upload, see utils.cache.MetadataCache.
+	def upload_convergent(self, ipfs, secret, index=None, pin=True, compress=False):
+		import hashlib
+		codec = CompressionMethods.choose(self.path) if compress else None
+		key = self.convergent_key(secret, codec)
+		entry = 'convergent:' + hashlib.sha256(key).hexdigest()
+		found = index.get(entry) if index else None
+		if found:
+			_hash, size, *stored = json.loads(found.decode())
+			if is_pinned(ipfs, _hash):
+				self.hash, self.size = _hash, size
+				return self.hash, key, stored[0] if stored else None
+
+		_hash, key, codec = self.upload(ipfs, EncryptionMethods.AES, key, pin, codec=codec)
+		if index:
+			index.put(entry, json.dumps([self.hash, self.size, codec]).encode())
+		return self.hash, key, codec
+
+	# Written to dest.part and renamed once complete, so a cancelled download leaves no truncated file at dest
+	def download(self, dest, ipfs, encrypt_cls, key, progress=None, codec=None):
+		if not ipfs: raise ValueError
+
+		download_stream(ipfs, self.hash, dest, encrypt_cls(key), progress, codec, resume=True)
+
+class DocumentBatch():
+	# Number of documents encrypted and uploaded concurrently
+	upload_workers = 4
+	# Number of files fetched concurrently when downloading a whole batch
+	download_workers = 4
+
+	# Slotted to keep large histories compact. Addresses are interned, as the same few repeat across rows.
+	# Documents loaded from the ledger are kept as (name, hash, path) tuples until first accessed.
+	__slots__ = ('title', 'timestamp', 'tx_hash', 'ipfs_hash', '_sender', '_receiver', '_documents', '_document_rows')
+
+	def __init__(self, title, sender=None, receiver=None):
+		self.title = title
+		self.timestamp = int(time.time())
+		self.documents = []
+		self.tx_hash = None
+		self.ipfs_hash = None
+
+		self.sender = sender
+		self.receiver = receiver
+
+	@property
+	def sender(self):
+		return self._sender
+	@sender.setter
+	def sender(self, value):
+		self._sender = sys.intern(value) if value else value
+
+	@property
+	def receiver(self):
+		return self._receiver
+	@receiver.setter
+	def receiver(self, value):
+		self._receiver = sys.intern(value) if value else value
+
+	@property
+	def documents(self):
+		if self._documents is None:
+			self._documents = []
+			for name, _hash, path, size in self._document_rows:
+				doc = Document(path, name)
+				doc.hash = _hash
+				doc.size = size
+				self._documents.append(doc)
+			self._document_rows = None
+		return self._documents
+	@documents.setter
+	def documents(self, value):
+		self._documents = value
+		self._document_rows = None
+
+	# Pickled as a dict of public attributes, the same state as before slots were used
+	def __getstate__(self):
+		keys = ('title', 'timestamp', 'documents', 'tx_hash', 'ipfs_hash', 'sender', 'receiver')
+		return {key: getattr(self, key) for key in keys}
+
+	def __setstate__(self, state):
+		self.__init__(state['title'])
+		for key, value in state.items():
+			setattr(self, key, value)
+
+	@property
+	def localtime(self):
+		dt = datetime.datetime.fromtimestamp(self.timestamp)
+		return str(dt)
+
+	def add_document(self, doc):
+		self.documents.append(doc)
+
+	# Plain representation used by the ledger store
+	def to_record(self):
+		batch = {key: getattr(self, key) for key in ('tx_hash', 'ipfs_hash', 'title', 'sender', 'receiver', 'timestamp')}
+		if self._documents is None:
+			documents = [{'name': name, 'hash': _hash, 'path': path, 'size': size} for name, _hash, path, size in self._document_rows]
+		else:
+			documents = [{'name': d.name, 'hash': d.hash, 'path': str(d.path), 'size': d.size} for d in self._documents]
+		return batch, documents
+
+	@classmethod
+	def from_record(cls, record):
+		batch, documents = record
+		db = cls(batch['title'], sender=batch['sender'], receiver=batch['receiver'])
+		for key in ('tx_hash', 'ipfs_hash', 'timestamp'):
+			setattr(db, key, batch[key])
+		db._documents = None
+		db._document_rows = tuple((d['name'], d['hash'], d['path'], d.get('size')) for d in documents)
+		return db
+
+	# Upload documents on a bounded pool of workers, returns the key and compression of each document by name.
+	# With a convergent secret, keys are derived from the content instead of using enc_key.
+	# Documents recorded in the journal are not uploaded again, the others are recorded as they complete.
+	# progress(doc, done, total) is called from the calling thread as each upload completes
+	def upload_documents(self, ipfs, enc_class, enc_key, max_workers=None, progress=None, convergent=None, index=None, compress=False, journal=None):
+		from concurrent.futures import ThreadPoolExecutor, as_completed
+		journal = journal or UploadJournal()
+		def upload(d):
+			if convergent:
+				return d.upload_convergent(ipfs, convergent, index, pin=False, compress=compress)
+			return d.upload(ipfs, enc_class, enc_key, pin=False, compress=compress)
+
+		settings = {}
+		done = 0
+		pending = []
+		uploaded = journal.get('documents', {})
+		for d in self.documents:
+			entry = uploaded.get(d.name)
+			if entry is None:
+				pending.append(d)
+				continue
+			d.hash, d.size = entry['hash'], entry['size']
+			settings[d.name] = (bytes.fromhex(entry['key']) if entry['key'] else None, entry['codec'])
+			done += 1
+			if progress:
+				progress(d, done, len(self.documents))
+
+		with ThreadPoolExecutor(max_workers or self.upload_workers) as pool:
+			futures = {pool.submit(upload, d): d for d in pending}
+			try:
+				for future in as_completed(futures):
+					d = futures[future]
+					_hash, key, codec = future.result()
+					settings[d.name] = (key, codec)
+					journal.set_item('documents', d.name, {'hash': d.hash, 'size': d.size, 'key': key and key.hex(), 'codec': codec})
+					done += 1
+					if progress:
+						progress(d, done, len(self.documents))
+			except BaseException:
+				# Do not start the remaining uploads after a failure or an abort from progress
+				for future in futures:
+					future.cancel()
+				raise
+		return settings
+
+	# convergent is the shared secret for convergent encryption, see Document.upload_convergent.
+	# Unencrypted documents deduplicate in IPFS without it.
+	# With compress, files which shrink enough are compressed before encryption, see CompressionMethods.
+	# With a journal from an earlier attempt, completed steps are skipped, see utils.journal.UploadJournal.
+	def upload(self, acc_send, acc_recv, nem, ipfs, invoice, encrypt=True, max_workers=None, progress=None, convergent=None, index=None, compress=True, journal=None):
+		assert(self.sender == acc_send.address)
+		assert(self.receiver == acc_recv.address)
+		journal = journal or UploadJournal()
+		with tracing.span('batch.upload'), tracing.memory('upload'):
+			# The transaction may have been sent by an interrupted attempt
+			if journal.get('announcing') and not journal.get('tx'):
+				found = self.find_announcement(nem, acc_send, acc_recv, journal.get('root'))
+				if found is None:
+					raise AnnouncementPending('The transaction for {} may have been sent already and is not sent again. Check the outgoing transactions, or remove the upload journal to send it anyway'.format(journal.get('root')))
+				journal.set('tx', {'transactionHash': {'data': found['hash']}})
+
+			# Upload documents
+			enc_class = EncryptionMethods.AES if encrypt else EncryptionMethods.Dummy
+			if journal.get('key'):
+				enc_key = bytes.fromhex(journal.get('key'))
+			else:
+				enc_key = enc_class.genkey()
+				journal.set('key', enc_key and enc_key.hex())
+			if not encrypt:
+				convergent = None
+			settings = self.upload_documents(ipfs, enc_class, enc_key, max_workers, progress, convergent, index, compress, journal)
+
+			tx = journal.get('tx')
+			if tx:
+				self.tx_hash = tx['transactionHash']['data']
+				self.ipfs_hash = journal.get('root')
+				return tx
+
+			# Build the directory tree locally once all child hashes are known
+			if not journal.get('files'):
+				files = Directory()
+				for d in self.documents:
+					files.add_link(d.name, d.hash, d.size)
+				ipfs_files = files.put(ipfs)
+				files_size = ipfs.object_stat(ipfs_files['Hash'])['CumulativeSize']
+				journal.set('files', [ipfs_files['Hash'], files_size])
+
+			root = Directory()
+			root.add_link('files', *journal.get('files'))
+			# Metadata blobs already added by an earlier attempt
+			for name, (_hash, size) in journal.get('links', {}).items():
+				root.add_link(name, _hash, size)
+			def add_data(name, data):
+				root.add_data(ipfs, name, data)
+				journal.set_item('links', name, root.links[name])
+
+			# Add metadata
+			if 'title' not in root.links:
+				add_data('title', self.title.encode())
+			if encrypt and 'key' not in root.links:
+				# TODO: encrypt AES key using NEM keypair before uploading
+				add_data('key', enc_key)
+			# Per-file settings, encrypted with the batch key
+			manifest = {'files': {}}
+			for name, (key, codec) in settings.items():
+				entry = {}
+				if convergent:
+					entry['key'] = key.hex()
+				if codec:
+					entry['codec'] = codec
+				if entry:
+					manifest['files'][name] = entry
+			if invoice:
+				codec = CompressionMethods.choose(invoice) if compress else None
+				if 'invoice' not in root.links:
+					with upload_stream(invoice, enc_class(enc_key), codec) as data:
+						add_data('invoice', data)
+				if codec:
+					manifest['invoice'] = {'codec': codec.name}
+			if (manifest['files'] or 'invoice' in manifest) and 'manifest' not in root.links:
+				data = json.dumps(manifest).encode()
+				add_data('manifest', enc_class(enc_key).encrypt(data))
+
+			# Only the final root is pinned, which pins the whole tree recursively
+			if not journal.get('pinned'):
+				ipfs_root = root.put(ipfs)
+				journal.set('root', ipfs_root['Hash'])
+				ipfs.pin_add(ipfs_root['Hash'])
+				journal.set('pinned', True)
+			ipfs_hash = journal.get('root')
+
+			logging.debug(ipfs_hash)
+
+			# Send transfer transaction, at most once.
+			# An RPC error leaves 'announcing' set: the node may have accepted the transfer without answering.
+			pubkey = acc_recv.pubkey if encrypt else None
+			journal.set('announcing', int(time.time()))
+			tx = nem.send_transfer_transaction(acc_send.privkey, self.receiver, 0, ipfs_hash, recv_pubkey=pubkey, block=1)
+			logging.debug(tx)
+			if not isinstance(tx, dict):
+				raise RuntimeError('Unexpected answer to the transaction: {}'.format(tx))
+			if tx.get('code') != 1 or 'transactionHash' not in tx:
+				# Refused by the node, so it can be sent again
+				journal.discard('announcing')
+				raise RuntimeError('Transaction not sent: {}'.format(tx))
+			journal.set('tx', tx)
+
+			self.tx_hash = tx['transactionHash']['data']
+			self.ipfs_hash = ipfs_hash
+
+			return tx
+
+	# An outgoing transaction among the most recent ones whose message is ipfs_hash
+	@classmethod
+	def find_announcement(cls, nem, acc_send, acc_recv, ipfs_hash):
+		for tx in nem.list_transactions(acc_send.address, 'outgoing')['data']:
+			if tx['recipient'] != acc_recv.address or not tx.get('payload'):
+				continue
+			msg = bytes.fromhex(tx['payload'])
+			if tx['type'] == 2:
+				msg = nem.decrypt(acc_send.privkey, acc_recv.pubkey, msg)
+			if msg == ipfs_hash.encode():
+				return tx
+		return None
+
+	@classmethod
+	def get_ipfs_hash(cls, acc_recv, tx, nem):
+		assert(tx['recipient'] == acc_recv.address)
+
+		# Decode transaction message, unless already decoded by the sidecar
+		msg = tx.get('message')
+		if msg is None:
+			if not tx.get('payload'):
+				logging.warning('{}: no message'.format(tx['hash']))
+				return None
+			msg = bytes.fromhex(tx['payload'])
+			if tx['type'] == 2:
+				msg = nem.decrypt(acc_recv.privkey, tx['signer'], msg)
+			try:
+				msg = msg.decode() if msg is not None else None
+			except UnicodeDecodeError:
+				msg = None
+			if msg is None:
+				logging.warning('{}: message could not be decoded'.format(tx['hash']))
+				return None
+
+		if msg.startswith('Q'):
+			return msg
+		else:
+			logging.warning('{}: message "{}" not recognized'.format(tx['hash'], msg))
+
+		return None
+
+	@classmethod
+	def _get_metadata(cls, _hash, ipfs):
+
+		# Return list of (name, hash, size) links within a directory
+		def parse_ipfs(ipfs, _hash):
+			files = ipfs.ls(_hash)
+			msg = [(f['Name'], f['Hash'], f.get('Size')) for f in files['Objects'][0]['Links']]
+			return msg
+
+		root = {name: _hash for name, _hash, size in parse_ipfs(ipfs, _hash)}
+		root['files'] = parse_ipfs(ipfs, root['files'])
+
+		# Check for required fields
+		for key in ('title', 'invoice'):
+			root[key]
+
+		return root
+
+	def get_metadata(self, ipfs):
+		return self._get_metadata(self.ipfs_hash, ipfs)
+
+	# Encryption class and key of the documents, given the batch metadata
+	def get_encryption(self, ipfs, metadata):
+		enc_key = metadata.get('key')
+		if enc_key:
+			return EncryptionMethods.AES, ipfs.cat_metadata(enc_key)
+		return EncryptionMethods.Dummy, None
+
+	# Settings recorded at upload: per-file entries under 'files' by name, and the 'invoice' entry.
+	# Empty for batches without a manifest, written by older versions.
+	def get_manifest(self, ipfs, metadata, enc_method, enc_key):
+		if 'manifest' not in metadata:
+			return {}
+		data = enc_method(enc_key).decrypt(ipfs.cat_metadata(metadata['manifest']))
+		return json.loads(data.decode())
+
+	# Key and compression of a stored file given its manifest entry.
+	# The key is its own when convergent and the batch key otherwise.
+	@staticmethod
+	def file_settings(entry, enc_key):
+		key = entry.get('key')
+		return bytes.fromhex(key) if key else enc_key, CompressionMethods.get(entry.get('codec'))
+
+	def download_document(self, ipfs, doc, dest, progress=None):
+		metadata = self.get_metadata(ipfs)
+		enc_method, enc_key = self.get_encryption(ipfs, metadata)
+		manifest = self.get_manifest(ipfs, metadata, enc_method, enc_key)
+		key, codec = self.file_settings(manifest.get('files', {}).get(doc.name, {}), enc_key)
+		doc.download(dest, ipfs, enc_method, key, progress, codec)
+
+	@classmethod
+	def from_metadata(cls, nem, ipfs, tx, ipfs_hash, meta):
+		db = DocumentBatch('', sender=nem.pubkey_to_address(tx['signer']), receiver=tx['recipient'])
+		nemesis_block = 1427587585
+		db.timestamp = nemesis_block + int(tx['timeStamp'])
+		db.tx_hash = tx['hash']
+		db.ipfs_hash = ipfs_hash
+		if meta:
+			db.title = ipfs.cat_metadata(meta['title']).decode()
+			for name, _hash, size in meta['files']:
+				d = Document('', name)
+				d.hash = _hash
+				d.size = size
+				db.add_document(d)
+		return db
+
+	# A transaction whose message is not an IPFS hash, or whose batch is malformed, gives an empty batch.
+	# Transient IPFS errors are raised, so the caller can retry the transaction later.
+	@classmethod
+	def from_transaction(cls, acc_recv, tx, nem, ipfs):
+		_hash = cls.get_ipfs_hash(acc_recv, tx, nem)
+		if _hash:
+			if not ipfs:
+				raise ConnectionError('IPFS is not connected')
+			try:
+				return cls.from_metadata(nem, ipfs, tx, _hash, cls._get_metadata(_hash, ipfs))
+			except Exception as e:
+				if is_transient(e):
+					raise
+				logging.exception('Batch {} of transaction {} is malformed'.format(_hash, tx['hash']))
+
+		return cls.from_metadata(nem, ipfs, tx, _hash, None)
+
+	# Files are fetched concurrently on a bounded pool of workers.
+	# An interrupted download is resumed into the same folder, which is marked by a .incomplete file
+	# until every file is written; finished files are kept and partial ones continued, see download_stream.
+	# A folder is only used while holding its lock, so concurrent downloads of a batch get their own.
+	# progress(done, total, name) is called as files are written and may raise to abort
+	def download(self, ipfs, destination, progress=None, max_workers=None):
+		if not ipfs: raise ValueError
+		with tracing.span('batch.download'), tracing.memory('download'):
+			destination = Path(destination)
+
+			# Generate a new folder by adding a numeric suffix, or take over an incomplete one
+			suffix_num = None
+			while True:
+				suffix = '_{}'.format(suffix_num) if suffix_num else ''
+				subdir = destination / ('{}_{}'.format(self.title, self.tx_hash) + suffix)
+				logging.debug(str(subdir))
+				try:
+					subdir.mkdir(parents=True)
+					created = True
+				except FileExistsError:
+					created = False
+				if (created or (subdir / '.incomplete').exists()) and lock_folder(subdir):
+					# The previous holder may have completed it before releasing the lock
+					if created or (subdir / '.incomplete').exists():
+						break
+					unlock_folder(subdir)
+				suffix_num = suffix_num+1 if suffix_num else 1
+			try:
+				(subdir / '.incomplete').touch()
+				(subdir / 'files').mkdir(exist_ok=True)
+				return self._download(ipfs, subdir, progress, max_workers)
+			finally:
+				unlock_folder(subdir)
+
+	def _download(self, ipfs, subdir, progress=None, max_workers=None):
+		from concurrent.futures import ThreadPoolExecutor, as_completed
+		metadata = self.get_metadata(ipfs)
+		enc_method, enc_key = self.get_encryption(ipfs, metadata)
+		manifest = self.get_manifest(ipfs, metadata, enc_method, enc_key)
+
+		# Download files, decrypting on the fly
+		# Todo: include name of invoice file in metadata
+		entries = manifest.get('files', {})
+		files = [(self.ipfs_hash + '/invoice', subdir / 'invoice.csv', self.file_settings(manifest.get('invoice', {}), enc_key))]
+		files += [(_hash, subdir / 'files' / name, self.file_settings(entries.get(name, {}), enc_key)) for name, _hash, size in metadata['files']]
+		done = sum(1 for path, dest, settings in files if dest.exists())
+
+		def fetch(path, dest, settings):
+			key, codec = settings
+			report = None
+			if progress:
+				report = lambda size: progress(done, len(files), dest.name)
+			download_stream(ipfs, path, dest, enc_method(key), report, codec, resume=True)
+
+		if progress:
+			progress(done, len(files), '')
+		with ThreadPoolExecutor(max_workers or self.download_workers) as pool:
+			futures = {pool.submit(fetch, *f): f for f in files if not f[1].exists()}
+			try:
+				for future in as_completed(futures):
+					future.result()
+					done += 1
+					if progress:
+						progress(done, len(files), futures[future][1].name)
+			except BaseException:
+				# Do not start the remaining downloads after a failure or an abort from progress
+				for future in futures:
+					future.cancel()
+				raise
+		(subdir / '.incomplete').unlink()
+
+		return str(subdir)
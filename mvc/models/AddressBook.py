@@ -1,8 +1,12 @@
 from ..utils import Storage
 from PyQt5 import QtCore
+import csv
 Qt = QtCore.Qt
 
 class AddressBookModel(QtCore.QAbstractTableModel):
+	# Emitted with the set of addresses whose alias changed
+	aliasesChanged = QtCore.pyqtSignal(object)
+
 	_headers = (
 		('Name', ),
 		('Address', ),
@@ -12,6 +16,8 @@ class AddressBookModel(QtCore.QAbstractTableModel):
 		super().__init__(parent)
 
 		self._data = []
+		# address -> alias, the last entry wins for duplicate addresses
+		self._index = {}
 		self.storage = Storage(self.loadDataDump, self.dumpData)
 
 	def rowCount(self, parent=None):
@@ -37,11 +43,13 @@ class AddressBookModel(QtCore.QAbstractTableModel):
 	def setData(self, index, value, role = Qt.EditRole):
 		if role == Qt.EditRole:
 
-			entry = list(self._data[index.row()])
+			old = self._data[index.row()]
+			entry = list(old)
 			entry[index.column()] = value
 			self._data[index.row()] = tuple(entry)
 
 			self.dataChanged.emit(index, index)
+			self.updateIndex({old[1], entry[1]})
 
 			return True
 
@@ -51,8 +59,26 @@ class AddressBookModel(QtCore.QAbstractTableModel):
 		return super().flags(index) | Qt.ItemIsEditable
 
 	def getAlias(self, addr):
-		entries = {address:alias for alias, address in self._data}
-		return entries.get(addr, None)
+		return self._index.get(addr, None)
+
+	# Recompute the index entries of the given addresses and notify about the ones that changed
+	def updateIndex(self, addresses):
+		addresses = set(addresses) - {''}
+		if not addresses:
+			return
+		aliases = {}
+		for alias, address in self._data:
+			if address in addresses:
+				aliases[address] = alias
+		changed = set()
+		for address in addresses:
+			old = self._index.pop(address, None)
+			if address in aliases:
+				self._index[address] = aliases[address]
+			if old != aliases.get(address):
+				changed.add(address)
+		if changed:
+			self.aliasesChanged.emit(changed)
 
 	def insertRows(self, position, rows, index=QtCore.QModelIndex()):
 		self.beginInsertRows(index, position, position+rows-1)
@@ -61,21 +87,58 @@ class AddressBookModel(QtCore.QAbstractTableModel):
 		return True
 
 	def removeRows(self, position, rows, index=QtCore.QModelIndex()):
+		removed = self._data[position:position+rows]
 		self.beginRemoveRows(index, position, position+rows-1)
 		del self._data[position:position+rows]
 		self.endRemoveRows()
+		self.updateIndex(address for alias, address in removed)
 		return True
 
 	def loadDataDump(self, data):
 		self.beginResetModel()
+		old = set(self._index)
 		self._data = [tuple(d) for d in data]
+		self._index = {}
 		self.endResetModel()
+		self.updateIndex(old | set(address for alias, address in self._data))
 
 	def dumpData(self):
-		return [
-			tuple(self.index(row, col).data() for col in range(self.columnCount())) \
-			for row in range(self.rowCount())
-		]
+		return list(self._data)
+
+	# Add or rename contacts from a CSV file of name,address rows, with an optional header row.
+	# Returns the number of entries read.
+	def importCSV(self, path):
+		with open(str(path), newline='') as f:
+			rows = [tuple(r[:2]) for r in csv.reader(f) if len(r) >= 2]
+		if rows and rows[0] == tuple(h for h, in self._headers):
+			rows = rows[1:]
+
+		rows_by_address = {address: i for i, (alias, address) in enumerate(self._data)}
+		# Addresses not in the book yet, in file order. The last name given to an address wins.
+		new = {}
+		for alias, address in rows:
+			row = rows_by_address.get(address)
+			if row is None:
+				new[address] = alias
+			else:
+				self._data[row] = (alias, address)
+				self.dataChanged.emit(self.index(row, 0), self.index(row, 0))
+
+		if new:
+			self.beginInsertRows(QtCore.QModelIndex(), len(self._data), len(self._data) + len(new) - 1)
+			self._data += [(alias, address) for address, alias in new.items()]
+			self.endInsertRows()
+
+		self.updateIndex(address for alias, address in rows)
+		if self.storage.initialized:
+			self.storage.save()
+		return len(rows)
+
+	def exportCSV(self, path):
+		with open(str(path), 'w', newline='') as f:
+			writer = csv.writer(f)
+			writer.writerow(h for h, in self._headers)
+			writer.writerows(self._data)
 
 	def sort(self, column, order):
 		pass
@@ -1,249 +1,12 @@
-from pathlib import Path
-import datetime
-import time
+from collections import OrderedDict
 import logging
-from ..utils import Storage
 from PyQt5.QtCore import (
 	QAbstractTableModel,
 	QModelIndex,
 	Qt,
 	QVariant
 )
-
-class EncryptionMethods():
-# TODO: Stream data instead of storing in memory
-	class Base():
-		def __init__(self, key=None):
-			self.key = None
-
-		@classmethod
-		def genkey(cls):
-			return None
-
-	class Dummy(Base):
-		def encrypt(self, data):
-			return data
-
-		def decrypt(self, data):
-			return data
-
-	class AES(Base):
-		import os, pyaes
-
-		def __init__(self, key=None):
-			self.key = key or self.genkey()
-			self.mode = self.pyaes.AESModeOfOperationCTR(self.key)
-
-		@classmethod
-		def genkey(cls):
-			return cls.os.urandom(32)
-
-		def encrypt(self, data):
-			return self.mode.encrypt(data)
-
-		def decrypt(self, data):
-			return self.mode.decrypt(data)
-
-class Document():
-	def __init__(self, path, name=None):
-		self.path = Path(path)
-		self.name = name if name else self.path.name
-		self.hash = ''
-
-	def upload(self, ipfs, encrypt_cls, key):
-		import io
-		enc = encrypt_cls(key)
-		data = io.BytesIO(enc.encrypt(self.path.open('rb').read()))
-		res = ipfs.add(data)
-		logging.debug(res)
-		self.hash = res['Hash']
-
-		return self.hash, enc.key
-
-	def download(self, dest, ipfs, encrypt_cls, key):
-		if not ipfs: raise ValueError
-
-		data = ipfs.cat(self.hash)
-		data = encrypt_cls(key).decrypt(data)
-		open(dest, 'wb').write(data)
-
-class DocumentBatch():
-	def __init__(self, title, sender=None, receiver=None):
-		self.title = title
-		self.timestamp = int(time.time())
-		self.documents = []
-		self.tx_hash = None
-		self.ipfs_hash = None
-
-		self.sender = sender
-		self.receiver = receiver
-
-	@property
-	def localtime(self):
-		dt = datetime.datetime.fromtimestamp(self.timestamp)
-		return str(dt)
-
-	def add_document(self, doc):
-		self.documents.append(doc)
-
-	def upload(self, acc_send, acc_recv, nem, ipfs, invoice, encrypt=True):
-		assert(self.sender == acc_send.address)
-		assert(self.receiver == acc_recv.address)
-
-		# Upload documents
-		ipfs_files = ipfs.object_new('unixfs-dir')
-		enc_class = EncryptionMethods.AES if encrypt else EncryptionMethods.Dummy
-		enc_key = enc_class.genkey()
-		for d in self.documents:
-			d.upload(ipfs, enc_class, enc_key)
-			ipfs_files = ipfs.object_patch_add_link(ipfs_files['Hash'], d.name, d.hash)
-
-		ipfs.pin_add(ipfs_files['Hash'])
-		for d in self.documents:
-			ipfs.pin_rm(d.hash)
-
-		# Root directory
-		ipfs_root = ipfs.object_new('unixfs-dir')
-		ipfs_root = ipfs.object_patch_add_link(ipfs_root['Hash'], 'files', ipfs_files['Hash'])
-		ipfs.pin_update(ipfs_files['Hash'], ipfs_root['Hash'], unpin=True)
-
-		import io
-		def add_link_data(root, name, data):
-			res = ipfs.add(io.BytesIO(data), pin=False)
-			new = ipfs.object_patch_add_link(root['Hash'], name, res['Hash'])
-			ipfs.pin_update(root['Hash'], new['Hash'], unpin=True)
-			#ipfs.pin_rm(res['Hash'])
-			return new
-
-		# Add metadata
-		ipfs_root = add_link_data(ipfs_root, 'title', self.title.encode())
-		if encrypt:
-			# TODO: encrypt AES key using NEM keypair before uploading
-			ipfs_root = add_link_data(ipfs_root, 'key', enc_key)
-		if invoice:
-			data = invoice.open('rb').read()
-			data = enc_class(enc_key).encrypt(data)
-			ipfs_root = add_link_data(ipfs_root, 'invoice', data)
-
-		logging.debug(ipfs_root['Hash'])
-
-		# Send transfer transaction
-		pubkey = acc_recv.pubkey if encrypt else None
-		tx = nem.send_transfer_transaction(acc_send.privkey, self.receiver, 0, ipfs_root['Hash'], recv_pubkey=pubkey, block=1)
-		logging.debug(tx)
-
-		self.tx_hash = tx['transactionHash']['data']
-		self.ipfs_hash = ipfs_root['Hash']
-
-		return tx
-
-	@classmethod
-	def get_ipfs_hash(cls, acc_recv, tx, nem):
-		assert(tx['transaction']['recipient'] == acc_recv.address)
-
-		msg = tx['transaction']['message']['payload']
-		msg = bytes.fromhex(msg)
-		# Decode transaction message
-		if tx['transaction']['message']['type'] == 2:
-			msg = nem.decrypt(acc_recv.privkey, tx['transaction']['signer'], msg)
-		msg = msg.decode()
-
-		tx_hash = tx['meta']['hash']['data']
-		if msg.startswith('Q'):
-			return msg
-		else:
-			logging.warning('{}: message "{}" not recognized'.format(tx_hash, msg))
-
-		return None
-
-	@classmethod
-	def _get_metadata(cls, _hash, ipfs):
-
-		# Return list of links within a directory
-		def parse_ipfs(ipfs, _hash):
-			files = ipfs.ls(_hash)
-			msg = [(f['Name'], f['Hash']) for f in files['Objects'][0]['Links']]
-			return msg
-
-		root = dict(parse_ipfs(ipfs, _hash))
-		root['files'] = parse_ipfs(ipfs, root['files'])
-
-		# Check for required fields
-		for key in ('title', 'invoice'):
-			root[key]
-
-		return root
-
-	def get_metadata(self, ipfs):
-		return self._get_metadata(self.ipfs_hash, ipfs)
-
-	@classmethod
-	def from_metadata(cls, nem, ipfs, tx, ipfs_hash, meta):
-		db = DocumentBatch('', sender=nem.pubkey_to_address(tx['transaction']['signer']), receiver=tx['transaction']['recipient'])
-		nemesis_block = 1427587585
-		db.timestamp = nemesis_block + int(tx['transaction']['timeStamp'])
-		db.tx_hash = tx['meta']['hash']['data']
-		db.ipfs_hash = ipfs_hash
-		if meta:
-			db.title = ipfs.cat(meta['title']).decode()
-			for name, _hash in meta['files']:
-				d = Document('', name)
-				d.hash = _hash
-				db.add_document(d)
-		return db
-
-	@classmethod
-	def from_transaction(cls, acc_recv, tx, nem, ipfs):
-		_hash = None
-		try:
-			_hash = cls.get_ipfs_hash(acc_recv, tx, nem)
-			metadata = cls._get_metadata(_hash, ipfs)
-		except Exception as e:
-			logging.error('Error when parsing transaction {}:'.format(tx['meta']['hash']['data']))
-			import traceback
-			traceback.print_exc()
-			metadata = None
-
-		db = cls.from_metadata(nem, ipfs, tx, _hash, metadata)
-		return db
-
-	def download(self, ipfs, destination):
-		if not ipfs: raise ValueError
-
-		destination = Path(destination)
-
-		# Generate a new folder by adding a numeric suffix
-		suffix_num = None
-		while True:
-			suffix = '_{}'.format(suffix_num) if suffix_num else ''
-			subdir = destination / ('{}_{}'.format(self.title, self.tx_hash) + suffix)
-			logging.debug(str(subdir))
-			if subdir.exists():
-				suffix_num = suffix_num+1 if suffix_num else 1
-			else:
-				break
-		subdir.mkdir()
-		# Download files
-		ipfs.get(self.ipfs_hash + '/files', filepath=str(subdir)+'/')
-
-		metadata = self.get_metadata(ipfs)
-		# Todo: include name of invoice file in metadata
-		open(str(subdir / 'invoice.csv'), 'wb').write(ipfs.cat(self.ipfs_hash + '/invoice'))
-
-		def decrypt_inplace(method, key, file_):
-			data = open(file_, 'rb').read()
-			data = method(key).decrypt(data)
-			open(file_, 'wb').write(data)
-
-		enc_key = metadata.get('key')
-		if enc_key:
-			enc_key = ipfs.cat(self.ipfs_hash + '/key')
-			method = EncryptionMethods.AES
-			for path in [subdir/'invoice.csv'] + [subdir/'files'/n for n,h in metadata['files']]:
-				path = str(path)
-				decrypt_inplace(method, enc_key, path)
-
-		return str(subdir)
+from ..core.DocumentBatch import Document, DocumentBatch
 
 class QTableModel(QAbstractTableModel):
 	_headers = ()
@@ -252,6 +15,8 @@ class QTableModel(QAbstractTableModel):
 		super().__init__(parent)
 
 		self._data = []
+		# (column, order) that rows are kept in, set by sort()
+		self._sort_order = None
 
 	def rowCount(self, parent=None):
 		return len(self._data)
@@ -259,19 +24,22 @@ class QTableModel(QAbstractTableModel):
 	def columnCount(self, parent=None):
 		return len(self._headers)
 
+	def rowData(self, row):
+		return self._data[row]
+
 	def data(self, index, role=Qt.DisplayRole):
 		if role in (Qt.DisplayRole, Qt.EditRole):
-			header, func = self._headers[index.column()]
-			data = self._data[index.row()]
+			header, func = self._headers[index.column()][:2]
+			data = self.rowData(index.row())
 			return func(self, data)
 		elif role == Qt.UserRole:
-			return self._data[index.row()]
+			return self.rowData(index.row())
 
 		return QVariant()
 
 	def headerData(self, section, orientation, role):
 		if role == Qt.DisplayRole:
-			header, func = self._headers[section]
+			header = self._headers[section][0]
 			return header
 
 		return QVariant()
@@ -297,11 +65,47 @@ class QTableModel(QAbstractTableModel):
 	def clear(self):
 		self.replaceData([])
 
+	# Sort key of a column, computed from the row object.
+	# Headers may give the key as a third element, otherwise the displayed value is used.
+	def sortKey(self, column):
+		header = self._headers[column]
+		if len(header) > 2:
+			return header[2]
+		func = header[1]
+		return lambda obj: func(self, obj)
+
 	def sort(self, column, order=Qt.AscendingOrder):
-		gen = iter(self.index(r, column) for r in range(self.rowCount()))
-		indexes = sorted(gen, key=self.data, reverse=order!=Qt.AscendingOrder)
-		newdata = [index.data(Qt.UserRole) for index in indexes]
-		self.replaceData(newdata)
+		self._sort_order = (column, order)
+		key = self.sortKey(column)
+		self.replaceData(sorted(self._data, key=key, reverse=order!=Qt.AscendingOrder))
+
+	# Binary search for the row obj belongs at among the first count rows, in the current sort order.
+	# obj goes after rows with an equal key, or before them if first is set.
+	def sortedPosition(self, obj, count=None, first=False):
+		column, order = self._sort_order
+		key = self.sortKey(column)
+		value = key(obj)
+		descending = order != Qt.AscendingOrder
+		lo, hi = 0, self.rowCount() if count is None else count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			other = key(self.rowData(mid))
+			if other == value:
+				after = not first
+			else:
+				after = (other > value) == descending
+			if after:
+				lo = mid + 1
+			else:
+				hi = mid
+		return lo
+
+	# Insert a single row, keeping the sort order if there is one
+	def insertData(self, obj):
+		row = len(self._data) if self._sort_order is None else self.sortedPosition(obj)
+		self.beginInsertRows(QModelIndex(), row, row)
+		self._data.insert(row, obj)
+		self.endInsertRows()
 
 class DocumentModel(QTableModel):
 	_headers = (
@@ -310,12 +114,8 @@ class DocumentModel(QTableModel):
 		('Hash', lambda self, obj: obj.hash),
 	)
 
-	def download_document(self, index, *args):
-		doc = self._data[index.row()]
-		doc.download(*args)
-
 	def getFileName(self, index):
-		doc = self._data[index.row()]
+		doc = self.rowData(index.row())
 		return doc.name
 
 class DocumentBatchModel(QTableModel):
@@ -325,7 +125,7 @@ class DocumentBatchModel(QTableModel):
 		('To', lambda self, obj: obj.receiver),
 		('ToAlias', lambda self, obj: self.alias_func(obj.receiver)),
 		('Title', lambda self, obj: obj.title),
-		('Date', lambda self, obj: obj.localtime),
+		('Date', lambda self, obj: obj.localtime, lambda obj: obj.timestamp),
 		('IPFS', lambda self, obj: obj.ipfs_hash),
 		('Hash', lambda self, obj: obj.tx_hash),
 	)
@@ -336,38 +136,129 @@ class DocumentBatchModel(QTableModel):
 		self.document_model = DocumentModel()
 		self.alias_func = lambda addr: addr
 
-		self.storage = Storage(self.replaceData, lambda : self._data)
+		self.ledger = None
+		self.direction = None
+		# Ledger-backed rows are read in pages as the view scrolls, keeping the most recently used pages
+		self._pages = OrderedDict()
+		self._total = 0
+		self._loaded = 0
+		# Newest first, which is also the order of the ledger
+		self._sort_order = (self.findColumn('Date'), Qt.DescendingOrder)
+
+	# Number of rows read from the ledger per page
+	page_size = 200
+	# Number of pages held in memory
+	max_pages = 10
 
 	def setCurrentDocumentBatch(self, index):
-		db = self._data[index.row()]
+		db = self.rowData(index.row())
 		self.document_model.replaceData(db.documents)
 
 	def replaceData(self, data):
 		super().replaceData(data)
 		self.document_model.clear()
 
-	def download_docbatch(self, index, dest, ipfs):
-		db = self._data[index.row()]
-		if db.ipfs_hash and db.tx_hash:
-			return db.download(ipfs, dest)
+	# Show the batches stored in ledger for one direction ('in' or 'out')
+	def setLedger(self, ledger, direction):
+		self.ledger = ledger
+		self.direction = direction
+		self.reload()
+
+	# Drop cached pages and start again from the first page of the ledger
+	def reload(self):
+		self.beginResetModel()
+		self._pages.clear()
+		self._total = self.ledger.count(self.direction)
+		self._loaded = min(self.page_size, self._total)
+		self.endResetModel()
+		self.document_model.clear()
+
+	def rowCount(self, parent=QModelIndex()):
+		if self.ledger is None:
+			return super().rowCount(parent)
+		return self._loaded
+
+	def canFetchMore(self, parent=QModelIndex()):
+		return self.ledger is not None and not parent.isValid() and self._loaded < self._total
+
+	def fetchMore(self, parent=QModelIndex()):
+		count = min(self.page_size, self._total - self._loaded)
+		self.beginInsertRows(QModelIndex(), self._loaded, self._loaded + count - 1)
+		self._loaded += count
+		self.endInsertRows()
+
+	def rowData(self, row):
+		if self.ledger is None:
+			return super().rowData(row)
+
+		page = row // self.page_size
+		if page in self._pages:
+			self._pages.move_to_end(page)
+		else:
+			records = self.ledger.load(self.direction, page * self.page_size, self.page_size)
+			self._pages[page] = [DocumentBatch.from_record(r) for r in records]
+			while len(self._pages) > self.max_pages:
+				self._pages.popitem(last=False)
+		return self._pages[page][row % self.page_size]
+
+	# Store batches and show them at their sorted position
+	def addBatches(self, data):
+		for db in data:
+			self.insertData(db)
+
+	def insertData(self, db):
+		if self.ledger is None:
+			return super().insertData(db)
+
+		# Among equal dates the ledger puts the newest row first
+		row = self.sortedPosition(db, self._loaded, first=True)
+		self.ledger.save(self.direction, [db.to_record()])
+
+		# Cached pages from the insertion point onwards are now shifted
+		for page in [p for p in self._pages if p >= row // self.page_size]:
+			del self._pages[page]
+
+		# Rows past the fetched ones become available through fetchMore
+		self._total += 1
+		if row < self._loaded or self._loaded == self._total - 1:
+			self.beginInsertRows(QModelIndex(), row, row)
+			self._loaded += 1
+			self.endInsertRows()
+
+	# The ledger always yields rows in descending date order
+	def sort(self, column, order=Qt.AscendingOrder):
+		if self.ledger is None:
+			super().sort(column, order)
+		elif (column, order) != self._sort_order:
+			logging.warning('Ledger-backed rows can only be sorted by descending date')
+
+	# Remove all batches, including stored ones
+	def reset(self):
+		if self.ledger:
+			self.ledger.clear(self.direction)
+			self.reload()
+		else:
+			self.clear()
+
+	# Repaint alias columns, only in rows referencing one of addresses if given
+	def refresh_aliases(self, addresses=None):
+		columns = [self.findColumn(col) for col in ('FromAlias', 'ToAlias')]
+		if addresses is None:
+			for col in columns:
+				index_start, index_end = [self.index(row, col) for row in (0, self.rowCount()-1)]
+				self.dataChanged.emit(index_start, index_end)
+			return
+
+		# Rows outside the cached pages are not on screen and are read afresh when shown
+		if self.ledger is None:
+			rows = enumerate(self._data)
 		else:
-			logging.warning('Invalid document batch')
-
-	def download_document(self, index1, index2, dest, ipfs):
-		db = self._data[index1.row()]
-		metadata = db.get_metadata(ipfs)
-		enc_key = metadata.get('key')
-		enc_method = EncryptionMethods.Dummy
-		if enc_key:
-			enc_key = ipfs.cat(db.ipfs_hash + '/key')
-			enc_method = EncryptionMethods.AES
-		self.document_model.download_document(index2, dest, ipfs, enc_method, enc_key)
-
-	def refresh_aliases(self):
-		for col in ('FromAlias', 'ToAlias'):
-			col = self.findColumn(col)
-			index_start, index_end = [self.index(row, col) for row in (0, self.rowCount()-1)]
-			self.dataChanged.emit(index_start, index_end)
+			rows = ((page * self.page_size + i, db) for page, dbs in self._pages.items() for i, db in enumerate(dbs))
+		for row, db in rows:
+			for col, addr in zip(columns, (db.sender, db.receiver)):
+				if addr in addresses:
+					index = self.index(row, col)
+					self.dataChanged.emit(index, index)
 
 def generate_data():
 	docbatches = []
@@ -1,12 +1,35 @@
 from contextlib import contextmanager
-import jsonrpyc
 from subprocess import Popen, PIPE
 import base64
 from functools import lru_cache
+import threading
+from .rpc import RPC
 
 @contextmanager
 def ContextDecorator(obj): yield obj
 
+class Cancelled(Exception):
+	pass
+
+class NullTask():
+	# Stands in for a background task when a task function is called directly on the current thread
+	is_cancelled = False
+
+	def cancel(self):
+		pass
+
+	def check(self):
+		pass
+
+	def progress(self, done, total, message=''):
+		pass
+
+	def byte_counter(self, total=None, message=''):
+		return lambda size: None
+
+	def post(self, func, *args, **kwargs):
+		func(*args, **kwargs)
+
 class Storage():
 	def __init__(self, load_func, save_func):
 		self.load_func = load_func
@@ -78,7 +101,7 @@ class Account():
 		self.storage = Storage(lambda v: self.__setattr__('label', v), lambda: self.label)
 
 	def get_incoming_transactions(self, nem):
-		return nem.get_incoming_transactions(self.address)
+		return nem.get_incoming_transactions(self.address, self.privkey)
 
 	def send_transfer_transaction(self, nem, amount, message):
 		assert(self.privkey)
@@ -89,38 +112,164 @@ class Account():
 		if self.storage.initialized:
 			self.storage.save()
 
+class TransactionSync():
+	# Pages through an account's transaction history, newest first, down to the
+	# high-water mark left by the previous sync. Progress is persisted through storage after every page:
+	#  last_id: every transaction up to this id was handled
+	#  partial: [low, high] id range handled by a sync that was interrupted, above last_id
+	#  retry: transactions which failed, by hash, as (transaction, attempts so far)
+	# Failed transactions do not hold the mark back, they are tried again until max_attempts.
+
+	max_attempts = 5
+
+	def __init__(self, direction='incoming', filter=None):
+		self.direction = direction
+		self.filter = filter
+		self.last_id = None
+		self.partial = None
+		self.retry = {}
+		self.storage = Storage(self.load_state, self.save_state)
+
+	def load_state(self, state):
+		# Older versions stored the mark alone
+		if not isinstance(state, dict):
+			state = {'last_id': state}
+		self.last_id = state.get('last_id')
+		self.partial = state.get('partial')
+		self.retry = dict(state.get('retry', {}))
+
+	def save_state(self):
+		return {'last_id': self.last_id, 'partial': self.partial, 'retry': self.retry}
+
+	def save(self):
+		if self.storage.initialized:
+			self.storage.save()
+
+	# Yields (txs, top, low, last) for each page of transactions not handled yet, newest first.
+	# Once a page and the ones before it were handled, advance(top, low, last) records it.
+	def pages(self, nem, address, privkey=None):
+		last_id, partial = self.last_id, self.partial
+		def is_new(tx_id):
+			if partial and partial[0] <= tx_id <= partial[1]:
+				return False
+			return last_id is None or tx_id > last_id
+
+		top = None
+		cursor = None
+		while True:
+			page = nem.list_transactions(address, self.direction, privkey, self.filter, cursor)
+			if page['first_id'] is None:
+				yield [], top, None, True
+				return
+			if top is None:
+				top = page['first_id']
+			txs = [tx for tx in page['data'] if is_new(tx['id'])]
+
+			# Continue below the range handled by an interrupted sync
+			cursor = page['last_id']
+			if partial and cursor <= partial[1]:
+				cursor = min(cursor, partial[0])
+			last = last_id is not None and cursor <= last_id
+			yield txs, top, cursor, last
+			if last:
+				return
+
+	# Transactions newer than the mark, and the id the mark should move to once they have been processed
+	def fetch(self, nem, address, privkey=None):
+		txs = []
+		newest = self.last_id
+		for page, top, low, last in self.pages(nem, address, privkey):
+			txs += page
+			if top is not None:
+				newest = top
+		return txs, newest
+
+	def advance(self, top, low, last):
+		if last:
+			if top is not None:
+				self.last_id = top
+			self.partial = None
+		else:
+			self.partial = [low, top]
+		self.save()
+
+	def failed(self, tx, attempts):
+		if attempts >= self.max_attempts:
+			self.retry.pop(tx['hash'], None)
+		else:
+			self.retry[tx['hash']] = (tx, attempts)
+		self.save()
+
+	def succeeded(self, tx):
+		if self.retry.pop(tx['hash'], None):
+			self.save()
+
+	def commit(self, last_id):
+		self.last_id = last_id
+		self.partial = None
+		self.save()
+
+	def reset(self):
+		self.retry = {}
+		self.commit(None)
+
 class NEM():
+	# The node sidecar takes a while to load nem-sdk, so it is only spawned on first use
 
 	def __init__(self):
-		proc = Popen(["node", "./node/coz"], stdin=PIPE, stdout=PIPE, universal_newlines=True)
-		self.proc = proc
-		self.rpc = jsonrpyc.RPC(stdout=proc.stdin, stdin=proc.stdout)
-		# First message must have id>0 or it is treated as notification. Node json-rpc-server-stream bug?
-		self.rpc._i = 0
+		self.proc = None
+		self._rpc = None
+		self._lock = threading.Lock()
+
+	@property
+	def rpc(self):
+		with self._lock:
+			if self._rpc is None:
+				proc = Popen(["node", "./node/coz"], stdin=PIPE, stdout=PIPE, universal_newlines=True)
+				self.proc = proc
+				self._rpc = RPC(stdout=proc.stdin, stdin=proc.stdout)
+			return self._rpc
+
+	# Spawn the sidecar if needed and wait until it answers
+	def start(self, timeout=None):
+		self.rpc('ping', timeout=timeout)
 
 	@lru_cache()
 	def privkey_to_pubkey(self, privkey):
 		params = {'privkey': privkey}
-		return self.rpc('privkey-to-pubkey', kwargs=params, block=0.1)
+		return self.rpc('privkey-to-pubkey', kwargs=params)
 
 	@lru_cache()
 	def pubkey_to_address(self, pubkey):
 		params = {'pubkey': pubkey}
-		return self.rpc('pubkey-to-address', kwargs=params, block=0.1)
+		return self.rpc('pubkey-to-address', kwargs=params)
+
+	# One page of transfer transactions, newest first, older than transaction id cursor if given.
+	# Transactions are compact dicts of hash, id, signer, recipient, timeStamp, type, payload,
+	# plus the decoded message text when it is plaintext or privkey can decrypt it.
+	# filter='ipfs' drops transactions whose message is known not to be an IPFS hash.
+	# Returns {'data': [...], 'first_id': newest id, 'last_id': cursor for the next page}
+	def list_transactions(self, address, direction='incoming', privkey=None, filter=None, cursor=None):
+		params = {'address': address, 'direction': direction}
+		if privkey:
+			params['privkey'] = privkey
+		if filter:
+			params['filter'] = filter
+		if cursor:
+			params['id'] = cursor
+		return self.rpc('list-transactions', kwargs=params)
 
 	def find_pubkey_from_address(self, address):
-		params = {'address': address}
-		txs = self.rpc('get-outgoing-transactions', kwargs=params, block=0.1)
-		if len(txs.get('data',[])):
-			tx = txs['data'][0]
-			pubkey = tx['transaction']['signer']
-			return pubkey
+		txs = self.list_transactions(address, 'outgoing')['data']
+		if len(txs):
+			return txs[0]['signer']
 
 		return None
 
-	def get_incoming_transactions(self, address):
-		params = {'address': address}
-		return self.rpc('get-incoming-transactions', kwargs=params, block=1)
+	# Full incoming history, see TransactionSync for incremental fetches
+	def get_incoming_transactions(self, address, privkey=None):
+		txs, last_id = TransactionSync('incoming', 'ipfs').fetch(self, address, privkey)
+		return txs
 
 	def send_transfer_transaction(self, privkey, address, amount, message, recv_pubkey=None, callback=None, block=0):
 		params = {
@@ -131,23 +280,30 @@ class NEM():
 		if recv_pubkey:
 			params['recv_pubkey'] = recv_pubkey
 
-		return self.rpc('send-transfer-transaction', kwargs=params, callback=callback, block=block)
-
-	@staticmethod
-	def encrypt_subproc(privkey, pubkey, msg, encrypt=True):
-		from subprocess import Popen, PIPE
-		proc = Popen(["node", "./node/encrypt", "encrypt" if encrypt else "decrypt"], stdin=PIPE, stdout=PIPE, universal_newlines=True)
-		input_ = '\n'.join([privkey, pubkey, msg])
-		return proc.communicate(input_)
+		future = self.rpc.call_async('send-transfer-transaction', kwargs=params)
+		if callback:
+			future.add_done_callback(lambda f: callback(f.exception(), None if f.exception() else f.result()))
+		if block:
+			return future.result()
+		return future
 
 	def encrypt(self, privkey, pubkey, payload):
-		out, err = self.encrypt_subproc(privkey, pubkey, payload, True)
+		params = {'privkey': privkey, 'pubkey': pubkey, 'msg': payload}
+		out = self.rpc('encode-message', kwargs=params)
 		if out:
 			return bytes.fromhex(out)
 
 	def decrypt(self, privkey, pubkey, payload):
+		return self.decrypt_many(privkey, [(pubkey, payload)])[0]
+
+	# Decrypt a list of (sender pubkey, payload) messages in a single call
+	def decrypt_many(self, privkey, messages):
 		from binascii import hexlify
-		payload = hexlify(payload).decode()
-		out, err = self.encrypt_subproc(privkey, pubkey, payload, False)
-		if out:
-			return bytes.fromhex(out)
+		if not messages:
+			return []
+		params = {
+			'privkey': privkey,
+			'messages': [{'pubkey': pubkey, 'payload': hexlify(payload).decode()} for pubkey, payload in messages],
+		}
+		out = self.rpc('decode-messages', kwargs=params)
+		return [bytes.fromhex(msg) if msg else None for msg in out]
@@ -0,0 +1,98 @@
+import json
+import sqlite3
+import threading
+
+class MetadataCache():
+	# Persistent key-value store with size-bounded LRU eviction.
+	# Keys are IPFS hashes or paths below them; IPFS content is immutable, so entries never go stale.
+	# Also holds the index of convergent uploads, which are checked against the pins before use.
+	# Access times of hits are kept in memory and written in one transaction, on the next put, every
+	# flush_count hits or on close, so reads do not each wait for a disk sync.
+	def __init__(self, path, max_size=32 << 20):
+		self.max_size = max_size
+		self.lock = threading.Lock()
+		self.touched = {}
+		self.db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+		self.db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, atime INTEGER)')
+		self.db.execute('CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)')
+		self.clock, self.size = self.db.execute('SELECT COALESCE(MAX(atime), 0), COALESCE(SUM(size), 0) FROM entries').fetchone()
+
+	def get(self, key):
+		with self.lock:
+			row = self.db.execute('SELECT value FROM entries WHERE key=?', (key,)).fetchone()
+			if row is None:
+				return None
+			self.clock += 1
+			self.touched[key] = self.clock
+			if len(self.touched) >= self.flush_count:
+				self.flush()
+			return bytes(row[0])
+
+	# Number of pending access times that triggers a write
+	flush_count = 100
+
+	def flush(self):
+		if not self.touched:
+			return
+		self.db.execute('BEGIN')
+		self.db.executemany('UPDATE entries SET atime=? WHERE key=?', [(atime, key) for key, atime in self.touched.items()])
+		self.db.execute('COMMIT')
+		self.touched.clear()
+
+	def put(self, key, value):
+		with self.lock:
+			self.flush()
+			self.clock += 1
+			old = self.db.execute('SELECT size FROM entries WHERE key=?', (key,)).fetchone()
+			self.db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, value, len(value), self.clock))
+			self.size += len(value) - (old[0] if old else 0)
+			self.evict()
+
+	def evict(self):
+		# Another process may have added or deleted rows, so the running size is checked against the table
+		if self.size > self.max_size:
+			self.size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+		while self.size > self.max_size:
+			row = self.db.execute('SELECT key, size FROM entries ORDER BY atime LIMIT 1').fetchone()
+			if row is None:
+				self.size = 0
+				break
+			key, size = row
+			self.db.execute('DELETE FROM entries WHERE key=?', (key,))
+			self.size -= size
+
+	def close(self):
+		with self.lock:
+			self.flush()
+			self.db.close()
+
+class CachedIPFS():
+	# Wraps an ipfsapi client, serving directory listings and small metadata blobs from a MetadataCache.
+	# All other calls go straight to the client.
+	def __init__(self, ipfs, cache):
+		self.ipfs = ipfs
+		self.cache = cache
+
+	def __getattr__(self, name):
+		return getattr(self.ipfs, name)
+
+	def ls(self, path, **kwargs):
+		key = 'ls:' + path
+		value = self.cache.get(key)
+		if value is not None:
+			return json.loads(value.decode())
+
+		res = self.ipfs.ls(path, **kwargs)
+		self.cache.put(key, json.dumps(res).encode())
+		return res
+
+	# Only for small blobs such as title and key, large files should use cat with stream=True
+	def cat_metadata(self, path):
+		key = 'cat:' + path
+		value = self.cache.get(key)
+		if value is not None:
+			return value
+
+		value = self.ipfs.cat(path)
+		self.cache.put(key, value)
+		return value
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import logging
+
+# AES-CTR implementations, in order of preference.
+# All backends start the 128-bit big-endian counter at 1, matching pyaes defaults,
+# so they produce byte-identical ciphertext and are interchangeable.
+# offset starts the keystream that many bytes in, to decrypt from the middle of a stream.
+backends = OrderedDict()
+
+def register(cls):
+	backends[cls.name] = cls
+	return cls
+
+def available():
+	return [name for name, cls in backends.items() if cls.available()]
+
+def get_backend(name=None):
+	if name:
+		if name not in backends:
+			raise ValueError('Unknown AES backend {}'.format(name))
+		cls = backends[name]
+		if not cls.available():
+			raise RuntimeError('AES backend {} is not installed'.format(name))
+		return cls
+	for cls in backends.values():
+		if cls.available():
+			return cls
+	raise RuntimeError('No AES backend available')
+
+class Backend():
+	name = None
+	_available = None
+
+	@classmethod
+	def available(cls):
+		if cls._available is None:
+			try:
+				cls.load()
+				cls._available = True
+			except ImportError:
+				logging.debug('AES backend {} not available'.format(cls.name))
+				cls._available = False
+		return cls._available
+
+	@classmethod
+	def load(cls):
+		raise ImportError
+
+	def __init__(self, key, offset=0):
+		self.key = key
+
+	# Discard the keystream up to offset within the first block
+	def skip(self, offset):
+		if offset % 16:
+			self.encrypt(bytes(offset % 16))
+
+	def encrypt(self, data):
+		raise NotImplementedError
+
+	# CTR mode is symmetric
+	def decrypt(self, data):
+		return self.encrypt(data)
+
+@register
+class Cryptography(Backend):
+	name = 'cryptography'
+
+	@classmethod
+	def load(cls):
+		from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+		from cryptography.hazmat.backends import default_backend
+		cls.Cipher, cls.algorithms, cls.modes = Cipher, algorithms, modes
+		cls.default_backend = staticmethod(default_backend)
+
+	def __init__(self, key, offset=0):
+		super().__init__(key)
+		counter = (1 + offset // 16).to_bytes(16, 'big')
+		cipher = self.Cipher(self.algorithms.AES(key), self.modes.CTR(counter), backend=self.default_backend())
+		self.ctx = cipher.encryptor()
+		self.skip(offset)
+
+	def encrypt(self, data):
+		return self.ctx.update(data)
+
+@register
+class PyCryptodome(Backend):
+	name = 'pycryptodome'
+
+	@classmethod
+	def load(cls):
+		from Crypto.Cipher import AES
+		from Crypto.Util import Counter
+		cls.AES, cls.Counter = AES, Counter
+
+	def __init__(self, key, offset=0):
+		super().__init__(key)
+		counter = self.Counter.new(128, initial_value=1 + offset // 16)
+		self.ctx = self.AES.new(key, self.AES.MODE_CTR, counter=counter)
+		self.skip(offset)
+
+	def encrypt(self, data):
+		return self.ctx.encrypt(data)
+
+@register
+class PyAES(Backend):
+	name = 'pyaes'
+
+	@classmethod
+	def load(cls):
+		import pyaes
+		cls.pyaes = pyaes
+
+	def __init__(self, key, offset=0):
+		super().__init__(key)
+		self.ctx = self.pyaes.AESModeOfOperationCTR(key, self.pyaes.Counter(1 + offset // 16))
+		self.skip(offset)
+
+	def encrypt(self, data):
+		return self.ctx.encrypt(data)
@@ -0,0 +1,70 @@
+from pathlib import Path
+import hashlib
+import json
+import os
+import threading
+
+class AnnouncementPending(Exception):
+	pass
+
+class UploadJournal():
+	# Checkpoints of one batch upload, so an interrupted send resumes where it stopped.
+	# Holds the batch key, each uploaded document, the directory and root hashes, and whether the
+	# transaction was announced. Saved as JSON after every step, through a rename so it is never torn.
+	# 'announcing' is set just before the transaction is sent: if it is found without 'tx', the outcome
+	# is unknown and the transaction must not be sent again.
+	# Without a path, the journal is only kept in memory.
+	def __init__(self, path=None):
+		self.path = Path(path) if path else None
+		self.lock = threading.Lock()
+		self.data = {}
+		if self.path and self.path.exists():
+			self.data = json.loads(self.path.read_text())
+
+	# Journal name for a send, from everything that determines what is uploaded
+	@staticmethod
+	def batch_id(*fields, files=()):
+		digest = hashlib.sha256(json.dumps(fields).encode())
+		for path in files:
+			stat = Path(path).stat()
+			digest.update(json.dumps([str(path), stat.st_size, stat.st_mtime_ns]).encode())
+		return digest.hexdigest()
+
+	def get(self, key, default=None):
+		return self.data.get(key, default)
+
+	def set(self, key, value):
+		with self.lock:
+			self.data[key] = value
+			self.save()
+
+	# Set an entry of a dict-valued key
+	def set_item(self, key, name, value):
+		with self.lock:
+			self.data.setdefault(key, {})[name] = value
+			self.save()
+
+	def discard(self, key):
+		with self.lock:
+			self.data.pop(key, None)
+			self.save()
+
+	def save(self):
+		if not self.path:
+			return
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		tmp = self.path.with_name(self.path.name + '.tmp')
+		with tmp.open('w') as f:
+			json.dump(self.data, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(str(tmp), str(self.path))
+
+	# Once the batch is stored
+	def remove(self):
+		if not self.path:
+			return
+		try:
+			self.path.unlink()
+		except FileNotFoundError:
+			pass
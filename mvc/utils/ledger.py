@@ -0,0 +1,115 @@
+import sqlite3
+import threading
+
+# Document batches sent and received by one account.
+# Batches are passed around as records: a dict of batch columns plus a list of document dicts.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batches (
+	id INTEGER PRIMARY KEY,
+	direction TEXT NOT NULL,
+	tx_hash TEXT,
+	ipfs_hash TEXT,
+	title TEXT,
+	sender TEXT,
+	receiver TEXT,
+	timestamp INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS batches_tx_hash ON batches (tx_hash, direction);
+CREATE INDEX IF NOT EXISTS batches_sender ON batches (sender);
+CREATE INDEX IF NOT EXISTS batches_receiver ON batches (receiver);
+CREATE INDEX IF NOT EXISTS batches_timestamp ON batches (direction, timestamp);
+CREATE TABLE IF NOT EXISTS documents (
+	batch_id INTEGER NOT NULL REFERENCES batches (id) ON DELETE CASCADE,
+	position INTEGER NOT NULL,
+	name TEXT,
+	hash TEXT,
+	path TEXT,
+	size INTEGER,
+	PRIMARY KEY (batch_id, position)
+);
+'''
+
+BATCH_COLUMNS = ('tx_hash', 'ipfs_hash', 'title', 'sender', 'receiver', 'timestamp')
+DOCUMENT_COLUMNS = ('name', 'hash', 'path', 'size')
+
+class Ledger():
+	def __init__(self, path):
+		self.lock = threading.Lock()
+		self.db = sqlite3.connect(str(path), check_same_thread=False)
+		self.db.execute('PRAGMA foreign_keys = ON')
+		self.db.executescript(SCHEMA)
+		# Ledgers written by older versions have no document sizes
+		if 'size' not in [row[1] for row in self.db.execute('PRAGMA table_info(documents)')]:
+			self.db.execute('ALTER TABLE documents ADD COLUMN size INTEGER')
+
+	# Insert or update records, matching existing batches by transaction hash
+	def save(self, direction, records):
+		with self.lock, self.db:
+			for batch, documents in records:
+				row = [batch[c] for c in BATCH_COLUMNS]
+				existing = None
+				if batch['tx_hash'] is not None:
+					existing = self.db.execute('SELECT id FROM batches WHERE tx_hash=? AND direction=?', (batch['tx_hash'], direction)).fetchone()
+				if existing:
+					batch_id, = existing
+					self.db.execute('UPDATE batches SET {} WHERE id=?'.format(', '.join(c + '=?' for c in BATCH_COLUMNS)), row + [batch_id])
+					self.db.execute('DELETE FROM documents WHERE batch_id=?', (batch_id,))
+				else:
+					cursor = self.db.execute(
+						'INSERT INTO batches (direction, {}) VALUES ({})'.format(', '.join(BATCH_COLUMNS), ', '.join('?' * (len(BATCH_COLUMNS) + 1))),
+						[direction] + row
+					)
+					batch_id = cursor.lastrowid
+				self.db.executemany(
+					'INSERT INTO documents (batch_id, position, {}) VALUES ({})'.format(', '.join(DOCUMENT_COLUMNS), ', '.join('?' * (len(DOCUMENT_COLUMNS) + 2))),
+					[[batch_id, i] + [d.get(c) for c in DOCUMENT_COLUMNS] for i, d in enumerate(documents)]
+				)
+
+	# Records in descending timestamp order, optionally a window of them
+	def load(self, direction, offset=0, limit=-1):
+		with self.lock:
+			batches = self.db.execute(
+				'SELECT id, {} FROM batches WHERE direction=? ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?'.format(', '.join(BATCH_COLUMNS)),
+				(direction, limit, offset)
+			).fetchall()
+			return self._records(batches)
+
+	# Record of the batch with the given transaction hash, or None
+	def find(self, direction, tx_hash):
+		with self.lock:
+			batches = self.db.execute(
+				'SELECT id, {} FROM batches WHERE tx_hash=? AND direction=?'.format(', '.join(BATCH_COLUMNS)),
+				(tx_hash, direction)
+			).fetchall()
+			records = self._records(batches)
+		return records[0] if records else None
+
+	# Attach documents to batch rows, called with the lock held
+	def _records(self, batches):
+		documents = {}
+		rows = self.db.execute(
+			'SELECT batch_id, {} FROM documents WHERE batch_id IN ({}) ORDER BY batch_id, position'.format(
+				', '.join(DOCUMENT_COLUMNS), ', '.join(str(row[0]) for row in batches)
+			)
+		)
+		for row in rows:
+			documents.setdefault(row[0], []).append(dict(zip(DOCUMENT_COLUMNS, row[1:])))
+
+		return [(dict(zip(BATCH_COLUMNS, row[1:])), documents.get(row[0], [])) for row in batches]
+
+	def count(self, direction):
+		with self.lock:
+			count, = self.db.execute('SELECT COUNT(*) FROM batches WHERE direction=?', (direction,)).fetchone()
+		return count
+
+	def has_transaction(self, direction, tx_hash):
+		with self.lock:
+			row = self.db.execute('SELECT 1 FROM batches WHERE tx_hash=? AND direction=?', (tx_hash, direction)).fetchone()
+		return row is not None
+
+	def clear(self, direction):
+		with self.lock, self.db:
+			self.db.execute('DELETE FROM batches WHERE direction=?', (direction,))
+
+	def close(self):
+		self.db.close()
@@ -0,0 +1,93 @@
+from concurrent.futures import Future
+import itertools
+import json
+import logging
+import threading
+import time
+
+from . import tracing
+
+class RPCError(Exception):
+	pass
+
+class RPC():
+	# JSON-RPC client over a pair of pipes, using the same request format as jsonrpyc.
+	# Any number of requests may be in flight at once: a reader thread matches
+	# responses to requests by id and resolves the corresponding futures.
+	# With tracing enabled, each call is recorded as rpc.<method> and the sidecar's
+	# own handler time as node.<method>.
+	def __init__(self, stdout, stdin):
+		self.stdout = stdout
+		self.stdin = stdin
+		self.pending = {}
+		self.lock = threading.Lock()
+		# First message must have id>0 or it is treated as notification. Node json-rpc-server-stream bug?
+		self.ids = itertools.count(1)
+
+		self.reader = threading.Thread(target=self.read_responses, daemon=True)
+		self.reader.start()
+
+	def call_async(self, method, args=(), kwargs=None):
+		future = Future()
+		with self.lock:
+			_id = next(self.ids)
+			self.pending[_id] = future
+			req = {
+				'jsonrpc': '2.0',
+				'method': method,
+				'id': _id,
+				'params': {'args': list(args), 'kwargs': kwargs or {}},
+			}
+			if tracing.enabled:
+				req['params']['trace'] = True
+			data = json.dumps(req) + '\n'
+			if tracing.enabled:
+				future.trace = (method, len(data), time.perf_counter())
+			self.stdout.write(data)
+			self.stdout.flush()
+		return future
+
+	def __call__(self, method, args=(), kwargs=None, timeout=None):
+		return self.call_async(method, args, kwargs).result(timeout)
+
+	def read_responses(self):
+		decoder = json.JSONDecoder()
+		for line in self.stdin:
+			# A line may hold several responses, or none at all
+			pos = 0
+			line = line.strip()
+			while pos < len(line):
+				start = pos
+				try:
+					res, pos = decoder.raw_decode(line, pos)
+				except ValueError:
+					logging.warning('Invalid RPC response: {}'.format(line))
+					break
+				while pos < len(line) and line[pos].isspace():
+					pos += 1
+				self.resolve(res, pos - start)
+
+		# Pipe closed, fail anything still waiting
+		with self.lock:
+			pending, self.pending = self.pending, {}
+		for future in pending.values():
+			future.set_exception(RPCError('Connection closed'))
+
+	def resolve(self, res, size=0):
+		with self.lock:
+			future = self.pending.pop(res.get('id'), None)
+		if future is None:
+			logging.warning('Unexpected RPC response: {}'.format(res))
+			return
+		result = res.get('result')
+		trace = getattr(future, 'trace', None)
+		if trace is not None:
+			method, sent, start = trace
+			if isinstance(result, dict) and 'timing' in result:
+				tracing.record('node.' + method, result['timing']['ms'] / 1000)
+				result = result.get('result')
+			tracing.record('rpc.' + method, time.perf_counter() - start, sent, size, 'error' in res)
+		if 'error' in res:
+			future.set_exception(RPCError(res['error']))
+		else:
+			future.set_result(result)
@@ -0,0 +1,101 @@
+from PyQt5 import QtCore
+import logging
+import threading
+import time
+from . import Cancelled
+
+class Task(QtCore.QRunnable):
+	# Runs func(*args, task=self, **kwargs) on a worker thread.
+	# func reports progress and reaches the GUI thread through the task; progress raises Cancelled once cancel() was called.
+	# All signals are emitted from the event loop of the thread the task was created on, normally the GUI thread,
+	# so connecting them right after starting the task never misses one.
+	class Signals(QtCore.QObject):
+		progress = QtCore.pyqtSignal(object, object, str)
+		result = QtCore.pyqtSignal(object)
+		failed = QtCore.pyqtSignal(object)
+		cancelled = QtCore.pyqtSignal()
+		finished = QtCore.pyqtSignal()
+		call = QtCore.pyqtSignal(object)
+
+	# Minimum interval in seconds between progress signals, cancellation is checked on every report
+	progress_interval = 0.1
+
+	def __init__(self, func, *args, **kwargs):
+		super().__init__()
+		self.setAutoDelete(False)
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+		self.signals = self.Signals()
+		self.signals.call.connect(lambda func: func())
+		self._cancel = threading.Event()
+		self._last_progress = 0
+
+	@property
+	def is_cancelled(self):
+		return self._cancel.is_set()
+
+	def cancel(self):
+		self._cancel.set()
+
+	def check(self):
+		if self._cancel.is_set():
+			raise Cancelled
+
+	def progress(self, done, total, message=''):
+		self.check()
+		now = time.monotonic()
+		if done == total or now - self._last_progress >= self.progress_interval:
+			self._last_progress = now
+			self.post(self.signals.progress.emit, done, total, message)
+
+	# Callback for streams reporting chunk sizes, total is the expected size if known
+	def byte_counter(self, total=None, message=''):
+		done = 0
+		def report(size):
+			nonlocal done
+			done += size
+			self.progress(done, total, message)
+		return report
+
+	# Run func on the GUI thread, e.g. to update a model
+	def post(self, func, *args, **kwargs):
+		self.signals.call.emit(lambda: func(*args, **kwargs))
+
+	def run(self):
+		try:
+			res = self.func(*self.args, task=self, **self.kwargs)
+		except Cancelled:
+			self.post(self.signals.cancelled.emit)
+		except Exception as e:
+			logging.exception('Task failed')
+			self.post(self.signals.failed.emit, e)
+		else:
+			self.post(self.signals.result.emit, res)
+		finally:
+			self.post(self.signals.finished.emit)
+
+class TaskRunner(QtCore.QObject):
+	# Thread pool that keeps running tasks alive until they finish
+	# Tasks mostly wait on the network, so the pool is not sized by the number of CPU cores
+	max_threads = 16
+
+	def __init__(self, max_threads=None, parent=None):
+		super().__init__(parent)
+		self.pool = QtCore.QThreadPool(self)
+		self.pool.setMaxThreadCount(max_threads or self.max_threads)
+		self.tasks = set()
+
+	def start(self, func, *args, **kwargs):
+		task = Task(func, *args, **kwargs)
+		self.tasks.add(task)
+		task.signals.finished.connect(lambda: self.tasks.discard(task))
+		self.pool.start(task)
+		return task
+
+	def cancel_all(self):
+		for task in list(self.tasks):
+			task.cancel()
+
+	def wait(self, msecs=-1):
+		return self.pool.waitForDone(msecs)
@@ -0,0 +1,250 @@
+import atexit
+import os
+import threading
+import time
+
+# Named spans recording duration, bytes in and out, and errors, aggregated into rolling histograms
+# and written periodically to a metrics file in the Prometheus text format.
+# Off by default: span() then returns a shared no-op, so instrumented call sites cost one check.
+# Enabled with enable(), or by setting COZ_TRACE to the metrics file path.
+# COZ_TRACEMALLOC=1 additionally writes tracemalloc snapshots of the upload and download paths.
+enabled = False
+metrics = {}
+path = None
+tracemalloc_enabled = False
+
+# Histogram bucket upper bounds in seconds
+buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+# The rolling window is made of slots, the oldest slot is dropped as time advances
+slot_seconds = 10
+slots = 6
+
+_lock = threading.Lock()
+_writer = None
+# Operations inside memory(), tracemalloc is started by the first and stopped by the last
+_memory_lock = threading.Lock()
+_memory_users = 0
+_memory_started = False
+
+class Metric():
+	def __init__(self, name):
+		self.name = name
+		self.count = 0
+		self.errors = 0
+		self.seconds = 0.0
+		self.bytes_in = 0
+		self.bytes_out = 0
+		self.slot = int(time.monotonic() // slot_seconds)
+		self.window = [[0] * (len(buckets) + 1)]
+
+	def record(self, seconds, bytes_in=0, bytes_out=0, error=False):
+		with _lock:
+			self.count += 1
+			self.errors += bool(error)
+			self.seconds += seconds
+			self.bytes_in += bytes_in
+			self.bytes_out += bytes_out
+			self.rotate()
+			counts = self.window[-1]
+			for i, bound in enumerate(buckets):
+				if seconds <= bound:
+					counts[i] += 1
+					break
+			else:
+				counts[-1] += 1
+
+	def rotate(self):
+		slot = int(time.monotonic() // slot_seconds)
+		if slot != self.slot:
+			self.window += [[0] * (len(buckets) + 1) for i in range(min(slot - self.slot, slots))]
+			del self.window[:-slots]
+			self.slot = slot
+
+	# Bucket counts over the rolling window
+	def histogram(self):
+		with _lock:
+			self.rotate()
+			return [sum(counts) for counts in zip(*self.window)]
+
+def get_metric(name):
+	metric = metrics.get(name)
+	if metric is None:
+		with _lock:
+			metric = metrics.setdefault(name, Metric(name))
+	return metric
+
+def record(name, seconds, bytes_in=0, bytes_out=0, error=False):
+	if enabled:
+		get_metric(name).record(seconds, bytes_in, bytes_out, error)
+
+class Span():
+	__slots__ = ('name', 'bytes_in', 'bytes_out', 'start')
+
+	def __init__(self, name, bytes_in=0):
+		self.name = name
+		self.bytes_in = bytes_in
+		self.bytes_out = 0
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, etype, value, tb):
+		get_metric(self.name).record(time.perf_counter() - self.start, self.bytes_in, self.bytes_out, etype is not None)
+
+class NullSpan():
+	__slots__ = ()
+	bytes_in = 0
+	bytes_out = 0
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, etype, value, tb):
+		pass
+
+	def __setattr__(self, name, value):
+		pass
+
+_null_span = NullSpan()
+
+def span(name, bytes_in=0):
+	if not enabled:
+		return _null_span
+	return Span(name, bytes_in)
+
+def _size(obj):
+	if isinstance(obj, (bytes, bytearray, str)):
+		return len(obj)
+	if hasattr(obj, 'tell') and hasattr(obj, 'read'):
+		try:
+			return obj.tell()
+		except (OSError, ValueError):
+			pass
+	return 0
+
+class Traced():
+	# Proxy recording a span per method call, named prefix.method.
+	# Bytes in are counted from bytes and file arguments, bytes out from bytes results;
+	# iterator results are timed until exhausted, counting the chunks they yield.
+	def __init__(self, obj, prefix):
+		self._obj = obj
+		self._prefix = prefix
+
+	def __getattr__(self, name):
+		attr = getattr(self._obj, name)
+		if not callable(attr):
+			return attr
+		def call(*args, **kwargs):
+			if not enabled:
+				return attr(*args, **kwargs)
+			span = Span('{}.{}'.format(self._prefix, name)).__enter__()
+			try:
+				res = attr(*args, **kwargs)
+			except BaseException as e:
+				span.__exit__(type(e), e, None)
+				raise
+			span.bytes_in = sum(_size(arg) for arg in args)
+			if hasattr(res, '__next__'):
+				return self._iterate(span, res)
+			span.bytes_out = _size(res)
+			span.__exit__(None, None, None)
+			return res
+		return call
+
+	def _iterate(self, span, chunks):
+		try:
+			for chunk in chunks:
+				span.bytes_out += _size(chunk)
+				yield chunk
+		except BaseException as e:
+			span.__exit__(type(e), e, None)
+			raise
+		span.__exit__(None, None, None)
+
+class memory():
+	# Writes the top allocations of a code path next to the metrics file, when tracemalloc is enabled.
+	# Operations may overlap: the peak is only reset when no other one is traced, and the recorded
+	# growth over the start then includes allocations of the others.
+	def __init__(self, label, limit=25):
+		self.label = label
+		self.limit = limit
+		self.active = False
+
+	def __enter__(self):
+		global _memory_users, _memory_started
+		if tracemalloc_enabled:
+			import tracemalloc
+			with _memory_lock:
+				if _memory_users == 0:
+					if not tracemalloc.is_tracing():
+						tracemalloc.start()
+						_memory_started = True
+					tracemalloc.reset_peak()
+				_memory_users += 1
+				self.active = True
+			self.base = tracemalloc.get_traced_memory()[0]
+			self.before = tracemalloc.take_snapshot()
+		return self
+
+	def __exit__(self, etype, value, tb):
+		global _memory_users, _memory_started
+		if not self.active:
+			return
+		import tracemalloc
+		snapshot = tracemalloc.take_snapshot()
+		current, peak = tracemalloc.get_traced_memory()
+		with _memory_lock:
+			_memory_users -= 1
+			if _memory_users == 0 and _memory_started:
+				tracemalloc.stop()
+				_memory_started = False
+		self.active = False
+		peak = max(0, peak - self.base)
+		record('memory.' + self.label, 0, bytes_out=peak)
+		out = '{}.{}-{}.tracemalloc.txt'.format(path or 'coz-metrics.txt', self.label, int(time.time() * 1000))
+		with open(out, 'w') as f:
+			f.write('# {}: peak {} bytes\n'.format(self.label, peak))
+			for stat in snapshot.compare_to(self.before, 'lineno')[:self.limit]:
+				f.write('{}\n'.format(stat))
+
+def export():
+	lines = []
+	for name, metric in sorted(metrics.items()):
+		labels = 'name="{}"'.format(name)
+		histogram = metric.histogram()
+		lines.append('# span {} window={}s'.format(name, slot_seconds * slots))
+		lines.append('coz_span_total{{{}}} {}'.format(labels, metric.count))
+		lines.append('coz_span_errors_total{{{}}} {}'.format(labels, metric.errors))
+		lines.append('coz_span_seconds_sum{{{}}} {:.6f}'.format(labels, metric.seconds))
+		lines.append('coz_span_bytes_in_total{{{}}} {}'.format(labels, metric.bytes_in))
+		lines.append('coz_span_bytes_out_total{{{}}} {}'.format(labels, metric.bytes_out))
+		cumulative = 0
+		for bound, count in zip(buckets + ('+Inf',), histogram):
+			cumulative += count
+			lines.append('coz_span_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+	return '\n'.join(lines) + '\n'
+
+def write():
+	if path:
+		tmp = path + '.tmp'
+		with open(tmp, 'w') as f:
+			f.write(export())
+		os.replace(tmp, path)
+
+def enable(metrics_path='coz-metrics.txt', interval=10, tracemalloc=False):
+	global enabled, path, tracemalloc_enabled, _writer
+	path = str(metrics_path)
+	tracemalloc_enabled = tracemalloc
+	enabled = True
+	if _writer is None:
+		def loop():
+			while True:
+				time.sleep(interval)
+				write()
+		_writer = threading.Thread(target=loop, daemon=True)
+		_writer.start()
+		atexit.register(write)
+
+if os.environ.get('COZ_TRACE'):
+	enable(os.environ['COZ_TRACE'], tracemalloc=os.environ.get('COZ_TRACEMALLOC') == '1')
@@ -78,6 +78,12 @@ class AddressBook(BaseView):
 				hbox.addWidget(button)
 				button.clicked.connect(self.remove_address)
 			hbox.addStretch(1)
+			with _cm(qt.QPushButton("Import...")) as button:
+				hbox.addWidget(button)
+				button.clicked.connect(self.import_csv)
+			with _cm(qt.QPushButton("Export...")) as button:
+				hbox.addWidget(button)
+				button.clicked.connect(self.export_csv)
 
 			addrs = qt.QTreeView()
 			self.treeview = addrs
@@ -106,6 +112,17 @@ class AddressBook(BaseView):
 		for row in rows:
 			self.treeview.model().removeRow(row)
 
+	def import_csv(self):
+		file_, filter_ = qt.QFileDialog.getOpenFileName(self.window, filter='CSV files (*.csv);;All files (*)')
+		if file_:
+			count = self.treeview.model().importCSV(file_)
+			qt.QMessageBox.information(self.window, None, 'Imported {} entries'.format(count))
+
+	def export_csv(self):
+		file_, filter_ = qt.QFileDialog.getSaveFileName(self.window, filter='CSV files (*.csv);;All files (*)')
+		if file_:
+			self.treeview.model().exportCSV(file_)
+
 	def on_close(self):
 		self.window.reject()
 		pass
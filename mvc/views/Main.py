@@ -55,8 +55,9 @@ class DocumentBatchMaster(qt.QTreeView):
 
 	def download_docbatch(self):
 		dir_ = qt.QFileDialog.getExistingDirectory(self)
-		subdir = self.view.controller.download_docbatch(self.model(), self.currentIndex(), dir_)
-		qt.QMessageBox.information(self, None, 'Files downloaded to {}'.format(subdir))
+		if dir_:
+			task = self.view.controller.download_docbatch(self.model(), self.currentIndex(), dir_)
+			self.view.track_task(task, 'Downloading', lambda subdir: qt.QMessageBox.information(self, None, 'Files downloaded to {}'.format(subdir)))
 
 class DocumentBatchDetail(qt.QWidget):
 	def __init__(self, parent, master, *args, **kwargs):
@@ -113,8 +114,40 @@ class DocumentBatchDetail(qt.QWidget):
 		index_master = self.master.currentIndex()
 		file_, filter_ = qt.QFileDialog.getSaveFileName(self, directory=model.getFileName(index))
 		if file_:
-			self.view.controller.download_document(self.master.model(), index_master, index, file_)
-			qt.QMessageBox.information(self, None, 'File downloaded to {}'.format(file_))
+			task = self.view.controller.download_document(self.master.model(), index_master, index, file_)
+			self.view.track_task(task, 'Downloading', lambda res: qt.QMessageBox.information(self, None, 'File downloaded to {}'.format(file_)))
+
+class TaskWidget(qt.QWidget):
+	# Status bar entry showing the progress of a background task, with a button to cancel it
+	def __init__(self, task, description, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+
+		hbox = qt.QHBoxLayout(self)
+		hbox.setContentsMargins(0,0,0,0)
+		self.label = qt.QLabel(description)
+		hbox.addWidget(self.label)
+		self.progress = qt.QProgressBar()
+		self.progress.setRange(0, 0)
+		self.progress.setMaximumWidth(150)
+		hbox.addWidget(self.progress)
+		with _cm(qt.QPushButton()) as button:
+			button.setIcon(QtGui.QIcon.fromTheme('process-stop'))
+			button.setToolTip('Cancel')
+			button.setFlat(True)
+			hbox.addWidget(button)
+			button.clicked.connect(task.cancel)
+			button.clicked.connect(lambda: button.setEnabled(False))
+
+		task.signals.progress.connect(self.set_progress)
+
+	def set_progress(self, done, total, message):
+		# Scaled to a fixed range, byte counts overflow the int QProgressBar uses
+		if total:
+			self.progress.setRange(0, 1000)
+			self.progress.setValue(1000 * done // total)
+		else:
+			self.progress.setRange(0, 0)
+		self.progress.setToolTip(message)
 
 class Main(BaseView):
 	class Signals(QtCore.QObject):
@@ -170,9 +203,10 @@ class Main(BaseView):
 
 			with _cm(debug.addMenu('Reset storage')) as menu:
 				reset_send = menu.addAction('Send')
-				reset_send.triggered.connect(controller.docbatch_model_send.clear)
+				reset_send.triggered.connect(controller.docbatch_model_send.reset)
 				reset_recv = menu.addAction('Receive')
-				reset_recv.triggered.connect(controller.docbatch_model_recv.clear)
+				reset_recv.triggered.connect(controller.docbatch_model_recv.reset)
+				reset_recv.triggered.connect(controller.sync_in.reset)
 				reset_both = menu.addAction('Both')
 				reset_both.triggered.connect(reset_send.trigger)
 				reset_both.triggered.connect(reset_recv.trigger)
@@ -228,7 +262,7 @@ class Main(BaseView):
 				with _cm(qt.QPushButton("Refresh")) as button:
 					button.setIcon(QtGui.QIcon.fromTheme('view-refresh'))
 					hbox.addWidget(button)
-					button.clicked.connect(controller.get_incoming_transactions)
+					button.clicked.connect(self.refresh)
 					self.signals.accountValidityChanged.connect(button.setEnabled)
 				with _cm(qt.QPushButton("Download...")) as button:
 					button_download = button
@@ -262,6 +296,30 @@ class Main(BaseView):
 
 		root.show()
 
+	# Show a task in the status bar until it finishes, and report its outcome
+	def track_task(self, task, description, on_result=None):
+		statusbar = self.window.statusBar()
+		widget = TaskWidget(task, description)
+		statusbar.addPermanentWidget(widget)
+		def finished():
+			statusbar.removeWidget(widget)
+			widget.deleteLater()
+		task.signals.finished.connect(finished)
+		task.signals.cancelled.connect(lambda: statusbar.showMessage('{}: cancelled'.format(description), 5000))
+		task.signals.failed.connect(lambda e: qt.QMessageBox.critical(self.window, None, '{}:\n{}'.format(type(e).__name__, str(e))))
+		if on_result:
+			task.signals.result.connect(on_result)
+
+	def refresh(self):
+		task = self.controller.refresh_incoming()
+		if task:
+			self.track_task(task, 'Refreshing')
+
+	def document_batch_sent(self, res):
+		res, msg = res
+		if not res:
+			qt.QMessageBox.warning(self.window, None, msg)
+
 	def new_document_batch(self):
 		from .NewDocumentBatch import NewDocumentBatch
 		view = NewDocumentBatch(self.controller, self)
@@ -274,8 +332,8 @@ class Main(BaseView):
 	def load_privkey(self):
 		file_, filter_ = qt.QFileDialog.getOpenFileName(self.window)
 		if file_:
-			self.controller.load_privkey(file_)
-			qt.QMessageBox.information(self.window, None, 'Loaded NEM account: {}'.format(self.controller.account.address))
+			task = self.controller.load_privkey(file_)
+			self.track_task(task, 'Loading private key', lambda account: qt.QMessageBox.information(self.window, None, 'Loaded NEM account: {}'.format(account.address)))
 
 	def change_account_label(self):
 		acc_label, ok = qt.QInputDialog.getText(self.window, 'Set account name', 'Account name', text=self.controller.account.label)
@@ -9,6 +9,7 @@ Qt = QtCore.Qt
 class NewDocumentBatch(BaseView):
 	def __init__(self, controller, parent, *args, **kwargs):
 		super().__init__(controller, qt.QDialog, parent.window, *args, **kwargs)
+		self.parent = parent
 
 		dialog = self.window
 		dialog.setWindowTitle("New transaction")
@@ -100,8 +101,7 @@ class NewDocumentBatch(BaseView):
 			path = Path(path)
 			docs.append({'path': path})
 
-		res, msg = self.controller.create_document_batch(invoice, docbatch, docs)
-		if res:
-			self.window.accept()
-		else:
-			qt.QMessageBox.warning(self.window, None, msg)
+		# Uploading continues in the background after the dialog closes
+		task = self.controller.send_document_batch(invoice, docbatch, docs)
+		self.parent.track_task(task, 'Sending {}'.format(docbatch['title']), self.parent.document_batch_sent)
+		self.window.accept()
@@ -5,6 +5,11 @@ var jsonrpc = require('json-rpc-server-stream')();
 
 // Create an NIS endpoint object
 var endpoint = nem.model.objects.create("endpoint")(nem.model.nodes.defaultTestnet, nem.model.nodes.defaultPort);
+// COZ_NIS_ENDPOINT=http://host:port points the sidecar at another node, such as the stand-in in bench/fakes.py
+if (process.env.COZ_NIS_ENDPOINT) {
+	var nis_url = process.env.COZ_NIS_ENDPOINT.match(/^(https?:\/\/[^:\/]+)(?::(\d+))?/)
+	endpoint = nem.model.objects.create("endpoint")(nis_url[1], nis_url[2] || nem.model.nodes.defaultPort);
+}
 //var endpoint =  nem.model.objects.create("endpoint")('http://23.228.67.85', nem.model.nodes.defaultPort);
 
 // Default RPC responses
@@ -18,8 +23,41 @@ var rpc_err = function(err, reply) {
 	reply(null, err)
 	jsonrpc.push('\n')
 }
+// Answered as a JSON-RPC error, raised by the caller
+var rpc_fail = function(err, reply) {
+	console.error(err)
+	reply({code: -32000, message: String((err && (err.code || err.message)) || err)})
+	jsonrpc.push('\n')
+}
+
+// Whether a failed request was answered by NIS with an error, rather than lost on the way
+var nis_refused = function(err) {
+	for (var res of [err, err && err.response, err && err.data]) {
+		if (!res)
+			continue
+		var status = res.statusCode || res.status
+		var body = res.body || res
+		if ((status >= 400 && status < 500) || (body && body.error !== undefined && body.message !== undefined))
+			return true
+	}
+	return false
+}
+
+// Register a handler. Requests with params.trace set are answered with
+// {result, timing: {ms}}, the time spent in the handler, for mvc/utils/tracing.py
+var on = function(method, handler) {
+	jsonrpc.rpc.on(method, (params, reply) => {
+		if (!(params && params.trace))
+			return handler(params, reply)
+		var start = process.hrtime()
+		handler(params, (err, res) => {
+			var t = process.hrtime(start)
+			reply(err, {result: res, timing: {ms: t[0] * 1e3 + t[1] / 1e6}})
+		})
+	})
+}
 
-jsonrpc.rpc.on('send-transfer-transaction', (params, reply) => {
+on('send-transfer-transaction', (params, reply) => {
 	params = params.kwargs
 
 	var common = nem.model.objects.create("common")("", params.privkey);
@@ -36,27 +74,119 @@ jsonrpc.rpc.on('send-transfer-transaction', (params, reply) => {
 	// Prepare the above object
 	var transactionEntity = nem.model.transactions.prepare("transferTransaction")(common, transferTransaction, nem.model.network.data.testnet.id)
 
-	// Serialize transfer transaction and announce
-	nem.model.transactions.send(common, transactionEntity, endpoint).then( (res) => rpc_res(res, reply), (err) => rpc_err(err, reply) );
+	// Serialize transfer transaction and announce.
+	// NIS answers with a NemAnnounceResult, whose code is 1 once accepted. An error answer from NIS is
+	// passed on as a result too, since the transfer was refused. A timeout or a lost connection is
+	// an RPC error: NIS may have accepted the transfer, so the caller must not send it again.
+	nem.model.transactions.send(common, transactionEntity, endpoint).then( (res) => rpc_res(res, reply), (err) => {
+		if (nis_refused(err))
+			rpc_err(err, reply)
+		else
+			rpc_fail(err, reply)
+	});
 });
 
-jsonrpc.rpc.on('get-incoming-transactions', (params, reply) => {
+on('get-incoming-transactions', (params, reply) => {
 	params = params.kwargs
 	nem.com.requests.account.transactions.incoming(endpoint, params.address).then( (res) => rpc_res(res, reply), (err) => rpc_err(err, reply) );
 });
 
-jsonrpc.rpc.on('get-outgoing-transactions', (params, reply) => {
+on('get-outgoing-transactions', (params, reply) => {
 	params = params.kwargs
 	nem.com.requests.account.transactions.outgoing(endpoint, params.address).then( (res) => rpc_res(res, reply), (err) => rpc_err(err, reply) );
 });
 
-jsonrpc.rpc.on('pubkey-to-address', (params, reply) => {
+// Message encryption, as used by encrypted transfer transactions
+// Payloads and results are hex strings
+on('encode-message', (params, reply) => {
+	params = params.kwargs
+	rpc_res(nem.crypto.helpers.encode(params.privkey, params.pubkey, params.msg), reply);
+});
+
+var decode_message = function(privkey, pubkey, payload) {
+	try {
+		return nem.crypto.helpers.decode(privkey, pubkey, payload)
+	} catch (err) {
+		console.error(err)
+		return null
+	}
+}
+
+on('decode-message', (params, reply) => {
+	params = params.kwargs
+	rpc_res(decode_message(params.privkey, params.pubkey, params.payload), reply);
+});
+
+// Decode a list of {pubkey, payload} messages sent to the same private key
+on('decode-messages', (params, reply) => {
+	params = params.kwargs
+	var res = params.messages.map((m) => decode_message(params.privkey, m.pubkey, m.payload))
+	rpc_res(res, reply);
+});
+
+// Compact view of a transfer transaction, with the message decoded when possible
+var project_transaction = function(tx, privkey) {
+	var t = tx.transaction
+	var res = {
+		hash: tx.meta.hash.data,
+		id: tx.meta.id,
+		signer: t.signer,
+		recipient: t.recipient,
+		timeStamp: t.timeStamp,
+		type: t.message ? t.message.type : null,
+		payload: t.message ? t.message.payload : null,
+	}
+	var payload = res.payload
+	if (payload && res.type === 2)
+		payload = privkey ? decode_message(privkey, res.signer, payload) : null
+	if (payload) {
+		try {
+			res.message = nem.utils.format.hexToUtf8(payload)
+		} catch (err) {
+			console.error(err)
+		}
+	}
+	return res
+}
+
+// Transaction filters, dropping transactions known not to match
+var transaction_filters = {
+	// Messages which decode to an IPFS hash, transfers without a message are dropped
+	ipfs: (tx) => !!tx.payload && (tx.message === undefined || tx.message.startsWith('Q')),
+}
+
+// One page of transactions, newest first, older than transaction id params.id if given.
+// first_id and last_id are the newest and oldest ids in the page before filtering,
+// last_id is the cursor for the next page and is null once the history is exhausted.
+on('list-transactions', (params, reply) => {
+	params = params.kwargs
+	var request = nem.com.requests.account.transactions[params.direction || 'incoming']
+	var filter = transaction_filters[params.filter] || ((tx) => true)
+	request(endpoint, params.address, undefined, params.id).then( (res) => {
+		// Only incoming messages can be decrypted with our own key
+		var privkey = params.direction === 'outgoing' ? null : params.privkey
+		var page = res.data
+		var txs = page.map((tx) => project_transaction(tx, privkey)).filter(filter)
+		rpc_res({
+			data: txs,
+			first_id: page.length ? page[0].meta.id : null,
+			last_id: page.length ? page[page.length-1].meta.id : null,
+		}, reply)
+	}, (err) => rpc_err(err, reply) );
+});
+
+// Answered once nem-sdk has loaded, used to start the sidecar ahead of the first real call
+on('ping', (params, reply) => {
+	rpc_res(true, reply);
+});
+
+on('pubkey-to-address', (params, reply) => {
 	params = params.kwargs
 	addr = nem.model.address.toAddress(params.pubkey, nem.model.network.data.testnet.id)
 	rpc_res(addr, reply);
 });
 
-jsonrpc.rpc.on('privkey-to-pubkey', (params, reply) => {
+on('privkey-to-pubkey', (params, reply) => {
 	params = params.kwargs
 	keypair = nem.crypto.keyPair.create(params.privkey);
 	pubkey = keypair.publicKey.toString();